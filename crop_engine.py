@@ -0,0 +1,856 @@
+# Crop Your Image engine -> crop, rotate, flip and resize pictures without the GUI
+# Used by the Crop Your Image app and as a batch tool for whole folders:
+#   python crop_engine.py INPUT_DIR OUTPUT_DIR --crop 0,0,800,600 --rotate 1 --flip --scale 50
+# and reports speed and memory of the engine with --benchmark NAME
+
+import argparse
+import copy
+import hashlib
+import mmap
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from PIL import Image
+from perf_trace import peak_memory_mb
+
+PYRAMID_BASE_SIZE = 2048 # Largest preview level kept in memory for the display
+PYRAMID_MIN_SIZE = 64 # Smallest preview level of the pyramid
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".ppm")
+PROGRESS_INTERVAL = 2.0 # Seconds between two progress reports of a batch
+BAND_PIXELS = 4_000_000 # Pixels decoded at once while reducing a huge picture for the preview
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+# Pillow refuses pictures above 179 MP as decompression bombs. Uncompressed files are read in bands and
+# regions from a memory map, so open_picture_file() allows those up to this size, compressed files keep the limit
+MAX_PICTURE_PIXELS = 2_000_000_000
+UNCOMPRESSED_FORMATS = ("PPM", "BMP", "TIFF") # Formats that can store their pixels raw
+PREVIEW_SIZE = 1024 # Largest side of the previews kept by PreviewCache
+PREVIEW_CACHE_BYTES = 256 * 1024 * 1024 # Disk space of the preview cache
+HISTORY_STEPS = 500 # Undo steps kept, the oldest are forgotten after this many
+HISTORY_PICTURE_BYTES = 32 * 1024 * 1024 # Memory for rendered pictures of undo steps
+JPEG_OPTIONS = {"quality": 85, "optimize": True, "progressive": False, "subsampling": None} # Encoder settings used by exports
+
+# jpegtran transform for (counter-clockwise quarter turns, flipped), same order as PictureEdits.TRANSPOSES
+JPEGTRAN_TRANSFORMS = {
+    (0, False): [],
+    (1, False): ["-rotate", "270"], # jpegtran turns clockwise
+    (2, False): ["-rotate", "180"],
+    (3, False): ["-rotate", "90"],
+    (0, True): ["-flip", "horizontal"],
+    (1, True): ["-transpose"],
+    (2, True): ["-flip", "vertical"],
+    (3, True): ["-transverse"],
+}
+
+# Crop, rotation, flip and resize of a picture, recorded as settings and rendered in one pass when needed
+class PictureEdits:
+    # Single PIL transpose for (counter-clockwise quarter turns, flipped), the flip comes before the turns
+    TRANSPOSES = {
+        (0, False): None,
+        (1, False): Image.Transpose.ROTATE_90,
+        (2, False): Image.Transpose.ROTATE_180,
+        (3, False): Image.Transpose.ROTATE_270,
+        (0, True): Image.Transpose.FLIP_LEFT_RIGHT,
+        (1, True): Image.Transpose.TRANSPOSE,
+        (2, True): Image.Transpose.FLIP_TOP_BOTTOM,
+        (3, True): Image.Transpose.TRANSVERSE,
+    }
+
+    def __init__(self, original_size, crop_box):
+        self.original_size = original_size
+        self.crop_box = crop_box # (x0, y0, x1, y1) in original picture pixels
+        self.quarter_turns = 0
+        self.flipped = False
+        self.scale_percent = 100
+
+    # Rotate by 90 degree steps, positive is counter-clockwise
+    def rotate(self, quarter_turns):
+        self.quarter_turns = (self.quarter_turns + quarter_turns) % 4
+
+    # Mirror left to right, flipping after the turns is the same as flipping first and turning back
+    def flip(self):
+        self.quarter_turns = -self.quarter_turns % 4
+        self.flipped = not self.flipped
+
+    # Size of the cropped picture after rotation, before resizing
+    def edited_size(self):
+        x0, y0, x1, y1 = self.crop_box
+        if self.quarter_turns % 2:
+            return y1 - y0, x1 - x0
+        return x1 - x0, y1 - y0
+
+    # Everything that changes the rendered picture, equal settings render the same picture
+    def settings(self):
+        return self.original_size, self.crop_box, self.quarter_turns, self.flipped, self.scale_percent
+
+    # Size of the final picture after resizing
+    def output_size(self):
+        width, height = self.edited_size()
+        return (max(1, int(width * self.scale_percent / 100)),
+                max(1, int(height * self.scale_percent / 100)))
+
+    # Render the edits from the original picture or a reduced copy of it
+    # size is the wanted final size, the output size is used when it is not given
+    def render(self, source, size=None, resample=Image.Resampling.LANCZOS):
+        width, height = size or self.output_size()
+        if self.quarter_turns % 2:
+            width, height = height, width # Resize happens before the turn
+
+        # Crop box in source pixels when the source is a reduced copy, whose sides were rounded down
+        ratio = source.width / self.original_size[0]
+        x0, y0, x1, y1 = (c * ratio for c in self.crop_box)
+        box = (x0, y0, min(x1, source.width), min(y1, source.height))
+        if ratio == 1 and (width, height) == (box[2] - box[0], box[3] - box[1]):
+            picture = source.crop(self.crop_box)
+        else:
+            picture = source.resize((width, height), resample, box=box)
+
+        transpose = self.TRANSPOSES[self.quarter_turns, self.flipped]
+        return picture.transpose(transpose) if transpose is not None else picture
+
+    # Render the edits from a picture file, decoding only the cropped part when the file layout allows it
+    def render_file(self, path, size=None, resample=Image.Resampling.LANCZOS):
+        region = read_region(path, self.crop_box)
+        if region is None:
+            with Image.open(path) as source:
+                return self.render(source, size, resample)
+        local = copy.copy(self)
+        local.original_size = region.size
+        local.crop_box = (0, 0, *region.size)
+        return local.render(region, size, resample)
+
+# Undo and redo of picture edits. Each step is a copy of the PictureEdits settings, or None when
+# there is no crop, so hundreds of steps take a few hundred KB. Rendered pictures are kept for the
+# steps that were shown while they fit memory_budget, least recently used go first, a step without one
+# is rendered again from the picture
+class EditHistory:
+    def __init__(self, memory_budget=HISTORY_PICTURE_BYTES):
+        self.memory_budget = memory_budget
+        self.steps = [None]
+        self.position = 0
+        self.pictures = OrderedDict() # (settings, size, resample) -> rendered picture, least recently used first
+        self.picture_bytes = 0
+
+    # Add the edits after a change as a new step, steps that could be redone are dropped
+    def record(self, edits):
+        current = self.steps[self.position]
+        if (current and current.settings()) == (edits and edits.settings()):
+            return
+        del self.steps[self.position + 1:]
+        self.steps.append(copy.copy(edits))
+        if len(self.steps) > HISTORY_STEPS:
+            del self.steps[0]
+        self.position = len(self.steps) - 1
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.steps) - 1
+
+    # Edits of the step before, a copy so changing it does not change the history
+    def undo(self):
+        self.position -= 1
+        return copy.copy(self.steps[self.position])
+
+    def redo(self):
+        self.position += 1
+        return copy.copy(self.steps[self.position])
+
+    # Rendered picture of edits at size, None when it has to be rendered
+    def picture(self, edits, size, resample):
+        key = (edits.settings(), size, resample)
+        if key in self.pictures:
+            self.pictures.move_to_end(key)
+            return self.pictures[key]
+        return None
+
+    def remember_picture(self, edits, size, resample, picture):
+        key = (edits.settings(), size, resample)
+        if key in self.pictures:
+            return
+        self.pictures[key] = picture
+        self.picture_bytes += picture_bytes(picture)
+        while self.picture_bytes > self.memory_budget and self.pictures:
+            _, dropped = self.pictures.popitem(last=False)
+            self.picture_bytes -= picture_bytes(dropped)
+
+    # Rendered pictures come from the current source pictures, a better source needs them rendered again
+    def forget_pictures(self):
+        self.pictures.clear()
+        self.picture_bytes = 0
+
+    # Approximate bytes held by the steps and the rendered pictures
+    def memory(self):
+        steps = sum(sys.getsizeof(step) + sys.getsizeof(vars(step)) + sys.getsizeof(step.crop_box)
+                    for step in self.steps if step)
+        return sys.getsizeof(self.steps) + steps + self.picture_bytes
+
+# Bytes of pixel data of a picture
+def picture_bytes(picture):
+    return picture.width * picture.height * len(picture.getbands())
+
+# Map a rectangle drawn on the displayed picture back to original picture pixels
+# Returns None when the rectangle does not cover any pixel
+def display_box_to_original(rect, display_origin, scale_ratio, original_size):
+    x0, y0, x1, y1 = rect
+    display_x, display_y = display_origin
+
+    # Calculates cropped area relative to displayed picture
+    cropped_x0 = max(min(x0, x1) - display_x, 0)
+    cropped_y0 = max(min(y0, y1) - display_y, 0)
+    cropped_x1 = max(max(x0, x1) - display_x, 0)
+    cropped_y1 = max(max(y0, y1) - display_y, 0)
+
+    # Using scale ratio, scales cropped coordinate back to original picture coordinates
+    return clamp_box((int(cropped_x0 * scale_ratio), int(cropped_y0 * scale_ratio),
+                      int(cropped_x1 * scale_ratio), int(cropped_y1 * scale_ratio)), original_size)
+
+# Clamp a crop box inside the picture, None when nothing is left
+def clamp_box(box, size):
+    width, height = size
+    x0, y0, x1, y1 = box
+    x0, x1 = max(0, min(x0, width)), max(0, min(x1, width))
+    y0, y1 = max(0, min(y0, height)), max(0, min(y1, height))
+    if x1 > x0 and y1 > y0:
+        return x0, y0, x1, y1
+    return None
+
+# Open a picture file like Image.open. Above Pillow's decompression bomb limit the file is only opened
+# when all its pixels are stored uncompressed, read_region() never decodes those whole
+def open_picture_file(path):
+    try:
+        return Image.open(path)
+    except Image.DecompressionBombError:
+        picture = open_unchecked(path)
+        if picture is None:
+            raise
+        if picture.width * picture.height > MAX_PICTURE_PIXELS or not all(tile[0] == "raw" for tile in picture.tile):
+            picture.close()
+            raise
+        return picture
+
+# Open an uncompressed format without Pillow's size check, None for other files
+def open_unchecked(path):
+    with open(path, "rb") as file:
+        prefix = file.read(16)
+    Image.init()
+    for name in UNCOMPRESSED_FORMATS:
+        factory, accept = Image.OPEN[name]
+        if accept(prefix) is True:
+            try:
+                return factory(path)
+            except (SyntaxError, IndexError, TypeError, ValueError):
+                return None
+    return None
+
+# Decode only the pixels of a picture file inside box, None when the file layout does not allow it
+# Uncompressed files (PPM, BMP, TIFF strips and tiles) are memory-mapped and only the rows
+# of the tiles touching box are read, compressed files need a full decode
+def read_region(path, box):
+    with open_picture_file(path) as picture:
+        box = clamp_box(box, picture.size)
+        if box is None or not picture.tile:
+            return None
+        if all(tile[0] == "raw" for tile in picture.tile):
+            return read_raw_region(picture, path, box)
+    return None
+
+# Copy the rows inside box out of a memory-mapped uncompressed file
+def read_raw_region(picture, path, box):
+    x0, y0, x1, y1 = box
+    region = Image.new(picture.mode, (x1 - x0, y1 - y0))
+    if picture.mode == "P":
+        region.putpalette(picture.palette.palette, picture.palette.rawmode or picture.palette.mode)
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for _, (tx0, ty0, tx1, ty1), offset, args in picture.tile:
+            if tx1 <= x0 or tx0 >= x1 or ty1 <= y0 or ty0 >= y1:
+                continue
+            rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+            if not stride:
+                try:
+                    stride = len(Image.new(picture.mode, (tx1 - tx0, 1)).tobytes("raw", rawmode))
+                except (ValueError, OSError):
+                    return None
+
+            # Rows of this tile inside box, read a band at a time so only the crop is kept in full
+            # Bottom-up files store the last row first
+            left = max(x0, tx0)
+            band_rows = max(1, BAND_PIXELS // (tx1 - tx0))
+            for row0 in range(max(y0, ty0) - ty0, min(y1, ty1) - ty0, band_rows):
+                row1 = min(row0 + band_rows, min(y1, ty1) - ty0)
+                first = row0 if orientation > 0 else (ty1 - ty0) - row1
+                data = mapped[offset + first * stride:offset + (first + row1 - row0) * stride]
+                rows = Image.frombytes(picture.mode, (tx1 - tx0, row1 - row0), data, "raw", rawmode, stride, orientation)
+                rows = rows.crop((left - tx0, 0, min(x1, tx1) - tx0, row1 - row0))
+                region.paste(rows, (left - x0, ty0 + row0 - y0))
+    return region
+
+# Modes the preview can be resized and reduced in
+def preview_mode(picture):
+    if picture.mode == "P":
+        return picture.convert("RGBA")
+    if picture.mode not in ("L", "LA", "RGB", "RGBA"):
+        return picture.convert("RGB")
+    return picture
+
+# Reduce a huge picture band by band so the whole picture is never decoded at once
+# None when the file layout does not allow reading bands
+def reduce_in_bands(path, size, max_size):
+    width, height = size
+    factor = -(-max(size) // max_size)
+    rows = max(factor, BAND_PIXELS // width // factor * factor)
+    reduced = None
+    for top in range(0, height, rows):
+        band = read_region(path, (0, top, width, min(height, top + rows)))
+        if band is None:
+            return None
+        band = preview_mode(band).reduce(factor)
+        if reduced is None:
+            reduced = Image.new(band.mode, (-(-width // factor), -(-height // factor)))
+        reduced.paste(band, (0, top // factor))
+    return reduced
+
+# Build reduced copies of a picture once so redraws never touch full resolution, largest first
+def build_picture_pyramid(path):
+    preview = open_picture_file(path)
+    if preview.format == "JPEG":
+        # JPEG decoder can scale down by 1/2, 1/4 or 1/8 while decoding
+        preview.draft("RGB", (PYRAMID_BASE_SIZE, PYRAMID_BASE_SIZE))
+    elif preview.width * preview.height > BAND_PIXELS and max(preview.size) > 2 * PYRAMID_BASE_SIZE:
+        preview = reduce_in_bands(path, preview.size, PYRAMID_BASE_SIZE) or preview
+    preview = preview_mode(preview)
+    preview.thumbnail((PYRAMID_BASE_SIZE, PYRAMID_BASE_SIZE), Image.Resampling.LANCZOS)
+
+    # Halve each level until the picture is small enough
+    pyramid = [preview]
+    while min(pyramid[-1].size) // 2 >= PYRAMID_MIN_SIZE:
+        pyramid.append(pyramid[-1].reduce(2))
+    return pyramid
+
+# Resize the smallest pyramid level that is still big enough for the display size
+def pyramid_preview(pyramid, width, height):
+    level = pyramid[0]
+    for candidate in pyramid:
+        if candidate.width < width or candidate.height < height:
+            break
+        level = candidate
+    if level.size == (width, height):
+        return level.copy()
+    return level.resize((width, height), Image.Resampling.LANCZOS)
+
+# Reduced copies of opened pictures kept on disk as raw pixels, so a picture opened again is shown
+# without decoding it. Entries are keyed by path, file size and mtime, a changed file misses.
+# The mtime of an entry is when it was last used, the least recently used go first when the cache is full
+class PreviewCache:
+    def __init__(self, directory, max_bytes=PREVIEW_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def entry_path(self, path):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".preview")
+
+    # (original size, preview) of a picture file, None when it is not cached
+    def get(self, path):
+        try:
+            entry = self.entry_path(path)
+            with open(entry, "rb") as file:
+                mode, width, height, preview_width, preview_height = file.readline().decode().split()
+                data = file.read()
+            os.utime(entry)
+            preview = Image.frombytes(mode, (int(preview_width), int(preview_height)), data)
+        except (OSError, ValueError):
+            return None
+        return (int(width), int(height)), preview
+
+    # Keep the largest pyramid level that fits PREVIEW_SIZE, a full cache is not an error
+    def put(self, path, original_size, pyramid):
+        preview = next((level for level in pyramid if max(level.size) <= PREVIEW_SIZE), None)
+        if preview is None:
+            preview = pyramid[-1].copy()
+            preview.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE), Image.Resampling.LANCZOS)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entry = self.entry_path(path)
+            with open(entry + ".tmp", "wb") as file:
+                file.write(f"{preview.mode} {original_size[0]} {original_size[1]} {preview.width} {preview.height}\n".encode())
+                file.write(preview.tobytes())
+            os.replace(entry + ".tmp", entry)
+            self.evict()
+        except OSError:
+            pass
+
+    # Remove the least recently used entries until the cache fits max_bytes
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(".preview"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(entry)
+            except OSError:
+                continue
+            total -= size
+
+# Small copy of a picture for lists of pictures, made from the cached preview when there is one
+def picture_thumbnail(path, size, cache=None):
+    cached = cache.get(path) if cache else None
+    if cached:
+        picture = cached[1]
+    else:
+        picture = Image.open(path)
+        if picture.format == "JPEG":
+            picture.draft("RGB", (size, size))
+        picture = preview_mode(picture)
+    picture.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return picture
+
+# Smallest reduced copy of the original that still has enough pixels to render the edits at size
+# None when only the full resolution file has enough pixels (a small crop shown large)
+def preview_source(pyramid, edits, size):
+    width = size[1] if edits.quarter_turns % 2 else size[0]
+    crop_width = edits.crop_box[2] - edits.crop_box[0]
+    for level in reversed(pyramid):
+        if crop_width * level.width / edits.original_size[0] >= width:
+            return level
+    return None
+
+# Size in pixels of the JPEG blocks (MCU) a lossless crop has to start on
+def jpeg_block_size(picture):
+    layers = getattr(picture, "layer", None) or [(None, 1, 1, None)]
+    return 8 * max(layer[1] for layer in layers), 8 * max(layer[2] for layer in layers)
+
+# Crop/rotate/flip a JPEG on its DCT blocks with jpegtran, without decoding and re-encoding it
+# Returns False when jpegtran is missing or the edits are not lossless for this picture
+def lossless_jpeg_edit(source_path, edits, output_path):
+    jpegtran = shutil.which("jpegtran")
+    if not jpegtran:
+        return False
+    x0, y0, x1, y1 = edits.crop_box
+    steps = []
+    if edits.crop_box != (0, 0, *edits.original_size):
+        steps.append(["-crop", f"{x1 - x0}x{y1 - y0}+{x0}+{y0}"])
+    transform = JPEGTRAN_TRANSFORMS[edits.quarter_turns, edits.flipped]
+    if transform:
+        # -perfect fails instead of dropping partial blocks at the edges
+        steps.append(["-perfect"] + transform)
+    if not steps:
+        shutil.copyfile(source_path, output_path)
+        return True
+
+    # Crop first, then transform the cropped file
+    current = source_path
+    for number, options in enumerate(steps):
+        target = output_path if number == len(steps) - 1 else output_path + ".crop.jpg"
+        result = subprocess.run([jpegtran, *options, "-outfile", target, current], capture_output=True)
+        if current != source_path:
+            os.remove(current)
+        if result.returncode != 0:
+            if os.path.exists(target):
+                os.remove(target)
+            return False
+        current = target
+    return True
+
+# Save the edits of a picture file at full resolution
+# JPEG to JPEG edits without resizing that start on block boundaries are done losslessly,
+# snap_to_blocks moves the crop start back to the block boundary to allow it
+# Returns (method, seconds, output bytes)
+def export_picture(source_path, edits, output_path, jpeg_options=None, snap_to_blocks=False):
+    started = time.perf_counter()
+    jpeg_output = output_path.lower().endswith(JPEG_EXTENSIONS)
+    with open_picture_file(source_path) as source:
+        jpeg_source = source.format == "JPEG"
+        block_width, block_height = jpeg_block_size(source)
+
+    if jpeg_source and jpeg_output and edits.scale_percent == 100:
+        x0, y0, x1, y1 = edits.crop_box
+        if snap_to_blocks:
+            edits = copy.copy(edits)
+            edits.crop_box = x0 - x0 % block_width, y0 - y0 % block_height, x1, y1
+            x0, y0 = edits.crop_box[:2]
+        if x0 % block_width == 0 and y0 % block_height == 0 and lossless_jpeg_edit(source_path, edits, output_path):
+            return "lossless", time.perf_counter() - started, os.path.getsize(output_path)
+
+    picture = edits.render_file(source_path)
+    options = {}
+    if jpeg_output:
+        options = {key: value for key, value in {**JPEG_OPTIONS, **(jpeg_options or {})}.items() if value is not None}
+        if picture.mode not in ("L", "RGB", "CMYK"):
+            picture = picture.convert("RGB") # JPEG has no transparency or palette
+    picture.save(output_path, **options)
+    return "re-encoded", time.perf_counter() - started, os.path.getsize(output_path)
+
+# Apply a batch recipe to one file, returns (input bytes, output bytes) or None when skipped
+def edit_file(path, output_dir, recipe):
+    with open_picture_file(path) as picture:
+        size = picture.size
+    box = clamp_box(recipe["crop"], size) if recipe["crop"] else (0, 0, *size)
+    if box is None:
+        return None
+    edits = PictureEdits(size, box)
+    if recipe["flip"]:
+        edits.flip()
+    edits.rotate(recipe["rotate"])
+    edits.scale_percent = recipe["scale"]
+    input_bytes = os.path.getsize(path)
+    output_path = os.path.join(output_dir, os.path.basename(path))
+    _, _, output_bytes = export_picture(path, edits, output_path, recipe["jpeg"], recipe["snap"])
+    return input_bytes, output_bytes
+
+# Stream picture paths of a folder without listing it all first
+def picture_paths(input_dir):
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
+
+# Edit every picture of a folder on a process pool, only a few files are in flight at any time
+def edit_folder(input_dir, output_dir, recipe, workers=None, report=sys.stderr):
+    workers = workers or os.cpu_count() or 1
+    # Edited pictures keep their file names, writing them into the input folder would replace the originals
+    if os.path.isdir(output_dir) and os.path.samefile(input_dir, output_dir):
+        raise ValueError(f"output folder {output_dir} is the input folder, the pictures would be overwritten")
+    os.makedirs(output_dir, exist_ok=True)
+    done = skipped = failed = 0
+    bytes_in = bytes_out = 0
+    started = last_report = time.perf_counter()
+
+    def progress(final=False):
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print(
+            f"{'done' if final else 'progress'}: {done} edited, {skipped} skipped, {failed} failed, "
+            f"{done / elapsed:.1f} images/s, {bytes_in / elapsed / 1e6:.1f} MB/s in, "
+            f"{bytes_out / 1e6:.1f} MB written, {elapsed:.1f} s",
+            file=report
+        )
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        paths = picture_paths(input_dir)
+        pending = {}
+        while True:
+            # Keep two files per worker queued so memory stays bounded on huge folders
+            for path in paths:
+                pending[pool.submit(edit_file, path, output_dir, recipe)] = path
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"failed: {path}: {e}", file=report)
+                    continue
+                if result is None:
+                    skipped += 1
+                else:
+                    done += 1
+                    bytes_in += result[0]
+                    bytes_out += result[1]
+            if time.perf_counter() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.perf_counter()
+                progress()
+    progress(final=True)
+    return done, skipped, failed
+
+BENCHMARK_PICTURE_SIZE = 20_000 # Side of the synthetic picture of the large-picture benchmark
+BENCHMARK_CROP_SIZE = 2_000 # Side of the crop it renders
+BENCHMARK_JPEG_SIZE = (8660, 5774) # 50 MP camera picture used by the other benchmarks
+BENCHMARK_DISPLAY_SIZE = (480, 320) # Size the app shows the picture at
+BENCHMARK_REDRAWS = 10
+BENCHMARK_DRAG_STEPS = 100 # Slider moves of the slider benchmark
+BENCHMARK_DRAG_STEP = 0.008 # Seconds between two of them
+BENCHMARK_RENDER_INTERVAL = 0.03 # Shortest time between two previews while dragging, SLIDER_RENDER_MS in the app
+BENCHMARK_CROP_BOX = (812, 271, 7848, 5503) # 7036x5232 crop of the benchmark JPEG
+BENCHMARK_CROPPED_AREA = (470, 580) # Right half of the app window the cropped picture is fitted in
+BENCHMARK_EDITS = 300 # Random edits made by the history benchmark
+
+# Temporary file for a synthetic benchmark picture
+def benchmark_path(suffix):
+    return os.path.join(tempfile.gettempdir(), f"crop_engine_benchmark_{os.getpid()}{suffix}")
+
+# Uncompressed RGB picture of size x size pixels with a diagonal gradient, written a row at a time
+def write_test_picture(path, size):
+    pattern = bytes(range(256)) * (size * 3 // 256 + 2)
+    with open(path, "wb") as file:
+        file.write(f"P6 {size} {size} 255\n".encode())
+        for y in range(size):
+            file.write(pattern[y % 256:y % 256 + size * 3])
+
+# JPEG with gradients and noise, so it compresses like a photo
+def write_test_jpeg(path, size):
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 40)
+    Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(path, quality=90)
+
+# Run function in this process and return (its result, seconds, peak memory in MB), used in a fresh
+# worker process for every benchmark case so the peak memory is the case's own
+def measured(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started, peak_memory_mb()
+
+def run_measured(function, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(measured, function, *args).result()
+
+def format_memory(megabytes):
+    return "unknown" if megabytes is None else f"{megabytes:,.0f} MB"
+
+# Decode the whole picture and crop it, what opening a picture did before read_region()
+def full_decode_crop(path, box):
+    with open_picture_file(path) as picture:
+        picture.load()
+        picture.crop(box)
+
+# Peak memory of the preview pyramid and a full resolution crop of a huge uncompressed picture,
+# against decoding it whole
+def large_picture_benchmark():
+    size, crop = BENCHMARK_PICTURE_SIZE, BENCHMARK_CROP_SIZE
+    path = benchmark_path(".ppm")
+    box = ((size - crop) // 2, (size - crop) // 2, (size + crop) // 2, (size + crop) // 2)
+    try:
+        write_test_picture(path, size)
+        print(f"{size}x{size} RGB picture, {os.path.getsize(path) / 1e6:,.0f} MB uncompressed")
+        cases = [
+            ("whole decode + crop", full_decode_crop, path, box),
+            ("preview pyramid", build_picture_pyramid, path),
+            (f"{crop}x{crop} crop", PictureEdits((size, size), box).render_file, path),
+        ]
+        for name, function, *args in cases:
+            _, seconds, peak = run_measured(function, *args)
+            print(f"{name}: {seconds:.2f} s, peak memory {format_memory(peak)}")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Redraws the way the app did before the pyramid, the whole picture copied and thumbnailed every time
+# Returns seconds per redraw
+def whole_picture_redraws(path, size, count):
+    with Image.open(path) as picture:
+        picture.load()
+        started = time.perf_counter()
+        for _ in range(count):
+            preview = picture.copy()
+            preview.thumbnail(size, Image.Resampling.LANCZOS)
+    return (time.perf_counter() - started) / count
+
+def pyramid_redraws(path, size, count):
+    pyramid = build_picture_pyramid(path)
+    started = time.perf_counter()
+    for _ in range(count):
+        pyramid_preview(pyramid, *size)
+    return (time.perf_counter() - started) / count
+
+# Redraw latency and peak memory of a 50 MP JPEG shown from the pyramid, against the whole picture
+def pyramid_benchmark():
+    path = benchmark_path(".jpg")
+    try:
+        # Written in a worker, on Linux new processes start from the peak memory of this one
+        run_measured(write_test_jpeg, path, BENCHMARK_JPEG_SIZE)
+        width, height = BENCHMARK_JPEG_SIZE
+        print(f"{width}x{height} JPEG shown at {BENCHMARK_DISPLAY_SIZE[0]}x{BENCHMARK_DISPLAY_SIZE[1]}, "
+              f"{BENCHMARK_REDRAWS} redraws")
+        for name, function in (("whole picture", whole_picture_redraws), ("pyramid", pyramid_redraws)):
+            redraw, seconds, peak = run_measured(function, path, BENCHMARK_DISPLAY_SIZE, BENCHMARK_REDRAWS)
+            print(f"{name}: {redraw * 1000:.1f} ms per redraw, {seconds:.2f} s with the decode, "
+                  f"peak memory {format_memory(peak)}")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Size the cropped picture is shown at for a slider value, fitted like the app does
+def fitted_size(edits, percent):
+    edits.scale_percent = percent
+    width, height = edits.output_size()
+    fit = min(BENCHMARK_CROPPED_AREA[0] / width, BENCHMARK_CROPPED_AREA[1] / height, 1)
+    return max(1, int(width * fit)), max(1, int(height * fit))
+
+# Drag the resize slider from 100% down in BENCHMARK_DRAG_STEPS moves and release it. Before, every move
+# queued a LANCZOS resize of the full resolution crop. Now the app keeps one pending BILINEAR preview at
+# most every BENCHMARK_RENDER_INTERVAL, rendered on a worker from the pyramid, and one LANCZOS on release
+def slider_benchmark():
+    path = benchmark_path(".jpg")
+    try:
+        run_measured(write_test_jpeg, path, BENCHMARK_JPEG_SIZE)
+        edits = PictureEdits(BENCHMARK_JPEG_SIZE, BENCHMARK_CROP_BOX)
+        percents = [100 - step * 99 // (BENCHMARK_DRAG_STEPS - 1) for step in range(BENCHMARK_DRAG_STEPS)]
+        drag_seconds = BENCHMARK_DRAG_STEPS * BENCHMARK_DRAG_STEP
+        width, height = edits.edited_size()
+        print(f"{BENCHMARK_DRAG_STEPS} step drag every {BENCHMARK_DRAG_STEP * 1000:.0f} ms on a {width}x{height} crop")
+
+        with Image.open(path) as picture:
+            cropped = picture.crop(BENCHMARK_CROP_BOX)
+        started = time.perf_counter()
+        for percent in percents:
+            cropped.resize(fitted_size(edits, percent), Image.Resampling.LANCZOS)
+        final = max(0.0, time.perf_counter() - started - drag_seconds)
+        print(f"before: {len(percents)} LANCZOS resizes, final frame {final:.2f} s after release")
+
+        pyramid = build_picture_pyramid(path)
+        resizes = {Image.Resampling.BILINEAR: 0, Image.Resampling.LANCZOS: 0}
+
+        def render(edits, size, resample):
+            resizes[resample] += 1
+            return edits.render(preview_source(pyramid, edits, size) or pyramid[0], size, resample)
+
+        with ThreadPoolExecutor(max_workers=1) as worker:
+            job = None
+            render_due = None # Time of the pending preview, like the app's slider after() handle
+            for percent in percents:
+                time.sleep(BENCHMARK_DRAG_STEP)
+                edits.scale_percent = percent
+                if render_due is None:
+                    render_due = time.perf_counter() + BENCHMARK_RENDER_INTERVAL
+                elif time.perf_counter() >= render_due:
+                    render_due = None
+                    if job:
+                        job.cancel() # Superseded before it started
+                    job = worker.submit(render, copy.copy(edits), fitted_size(edits, percent), Image.Resampling.BILINEAR)
+            released = time.perf_counter()
+            if job:
+                job.cancel()
+            worker.submit(render, copy.copy(edits), fitted_size(edits, percents[-1]), Image.Resampling.LANCZOS).result()
+            final = time.perf_counter() - released
+        print(f"after: {resizes[Image.Resampling.BILINEAR]} BILINEAR previews + {resizes[Image.Resampling.LANCZOS]} "
+              f"LANCZOS, final frame {final:.3f} s after release")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Random crop, rotate, flip or resize after edits, a new crop when there are no edits yet
+def random_edit(edits, size, rng):
+    choice = rng.random()
+    if edits is None or choice < 0.2:
+        x0, y0 = rng.randrange(size[0] - 100), rng.randrange(size[1] - 100)
+        box = (x0, y0, x0 + rng.randrange(100, size[0] // 2), y0 + rng.randrange(100, size[1] // 2))
+        return PictureEdits(size, clamp_box(box, size))
+    if choice < 0.5:
+        edits.rotate(rng.choice((1, -1)))
+    elif choice < 0.7:
+        edits.flip()
+    else:
+        edits.scale_percent = rng.randrange(5, 101)
+    return edits
+
+# Render edits for the display the way the app does, from the history when it kept the picture
+# Returns True when it did
+def render_with_history(history, pyramid, path, edits):
+    size = fitted_size(copy.copy(edits), edits.scale_percent)
+    if history.picture(edits, size, Image.Resampling.LANCZOS):
+        return True
+    source = preview_source(pyramid, edits, size)
+    picture = edits.render(source, size) if source else edits.render_file(path, size)
+    history.remember_picture(edits, size, Image.Resampling.LANCZOS, picture)
+    return False
+
+# Memory held by the undo history after BENCHMARK_EDITS random edits of a 50 MP picture, against a
+# full resolution copy for every step, and how fast undo and redo show the steps again
+def history_benchmark():
+    path = benchmark_path(".jpg")
+    try:
+        run_measured(write_test_jpeg, path, BENCHMARK_JPEG_SIZE)
+        pyramid = build_picture_pyramid(path)
+        rng = random.Random(5)
+        history = EditHistory()
+        edits = None
+        copies_bytes = 0
+        started = time.perf_counter()
+        for _ in range(BENCHMARK_EDITS):
+            edits = random_edit(edits, BENCHMARK_JPEG_SIZE, rng)
+            history.record(edits)
+            render_with_history(history, pyramid, path, edits)
+            width, height = edits.edited_size()
+            copies_bytes += width * height * 3
+        print(f"{BENCHMARK_EDITS} edits of a {BENCHMARK_JPEG_SIZE[0]}x{BENCHMARK_JPEG_SIZE[1]} JPEG in "
+              f"{time.perf_counter() - started:.1f} s: {len(history.steps)} steps, history {history.memory() / 1e6:.1f} MB "
+              f"({history.picture_bytes / 1e6:.1f} MB in {len(history.pictures)} kept pictures, budget "
+              f"{history.memory_budget / 1e6:.1f} MB), full resolution copies would take {copies_bytes / 1e9:.1f} GB")
+
+        for name, count in (("undo", 30), ("redo", 30), ("undo", 200)):
+            kept = 0
+            times = []
+            for _ in range(count):
+                step = history.undo() if name == "undo" else history.redo()
+                started = time.perf_counter()
+                kept += step is None or render_with_history(history, pyramid, path, step)
+                times.append(time.perf_counter() - started)
+            times.sort()
+            print(f"{count} x {name}: {kept} from kept pictures, median {times[count // 2] * 1000:.2f} ms, "
+                  f"worst {times[-1] * 1000:.0f} ms")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Name -> benchmark run by --benchmark
+BENCHMARKS = {
+    "pyramid": pyramid_benchmark,
+    "slider": slider_benchmark,
+    "history": history_benchmark,
+    "large-picture": large_picture_benchmark,
+}
+
+# Read "x0,y0,x1,y1" from the command line
+def parse_box(text):
+    try:
+        box = tuple(int(value) for value in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError("crop box must be four integers x0,y0,x1,y1")
+    if len(box) != 4:
+        raise argparse.ArgumentTypeError("crop box must be four integers x0,y0,x1,y1")
+    return box
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crop, rotate, flip and resize every picture of a folder.")
+    parser.add_argument("input_dir", nargs="?", help="folder with .png/.jpg/.jpeg/.tif/.tiff/.bmp/.ppm pictures")
+    parser.add_argument("output_dir", nargs="?", help="folder for the edited pictures, same file names")
+    parser.add_argument("--crop", type=parse_box, help="crop box x0,y0,x1,y1 in picture pixels, clamped to each picture")
+    parser.add_argument("--rotate", type=int, default=0, help="90 degree turns, positive is counter-clockwise")
+    parser.add_argument("--flip", action="store_true", help="mirror left to right (before rotating)")
+    parser.add_argument("--scale", type=float, default=100, help="resize percent of the cropped picture")
+    parser.add_argument("--workers", type=int, help="worker processes, all cores by default")
+    parser.add_argument("--quality", type=int, default=JPEG_OPTIONS["quality"], help="JPEG quality 1-95 when re-encoding")
+    parser.add_argument("--no-optimize", dest="optimize", action="store_false", help="skip the extra JPEG Huffman table pass")
+    parser.add_argument("--progressive", action="store_true", help="write progressive JPEGs")
+    parser.add_argument("--subsampling", choices=["4:4:4", "4:2:2", "4:2:0"], help="JPEG chroma subsampling")
+    parser.add_argument("--snap-to-blocks", action="store_true",
+                        help="move the crop start to the JPEG block boundary so JPEGs can be cropped losslessly")
+    parser.add_argument("--benchmark", choices=BENCHMARKS, help="report speed and memory of the engine instead")
+    args = parser.parse_args(argv)
+    if args.benchmark:
+        BENCHMARKS[args.benchmark]()
+        return 0
+    if not args.output_dir:
+        parser.error("input_dir and output_dir are required")
+
+    recipe = {
+        "crop": args.crop, "rotate": args.rotate, "flip": args.flip, "scale": args.scale, "snap": args.snap_to_blocks,
+        "jpeg": {"quality": args.quality, "optimize": args.optimize, "progressive": args.progressive,
+                 "subsampling": args.subsampling},
+    }
+    try:
+        done, skipped, failed = edit_folder(args.input_dir, args.output_dir, recipe, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
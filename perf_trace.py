@@ -0,0 +1,89 @@
+# Performance tracing -> timed spans for the apps, exported as Chrome trace JSON (chrome://tracing, Perfetto)
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+try:
+    import resource # Peak memory, only available on Unix
+except ImportError:
+    resource = None
+
+MAX_TRACE_EVENTS = 200_000 # Oldest events are dropped after this many
+
+# Span that does nothing, returned when tracing is disabled so the cost is one method call
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+# Times one block of code and records it in the trace
+class _Span:
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.started, time.perf_counter(), self.args)
+        return False
+
+class PerfTrace:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.events = deque(maxlen=MAX_TRACE_EVENTS) # (name, start, end, thread id, args)
+        self.last = {} # name -> duration in seconds of the latest span
+
+    # Use as "with trace.span("decode"):" around the code to time
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name, args)
+
+    # Record a span measured by the caller, start and end come from time.perf_counter()
+    def add(self, name, start, end, args=None):
+        if not self.enabled:
+            return
+        self.events.append((name, start, end, threading.get_ident(), args or {}))
+        self.last[name] = end - start
+
+    # Write the session as Chrome trace JSON
+    def export(self, path):
+        events = [
+            {
+                "name": name, "ph": "X", "pid": os.getpid(), "tid": thread,
+                "ts": (start - self.started) * 1e6, "dur": (end - start) * 1e6, "args": args,
+            }
+            for name, start, end, thread, args in list(self.events)
+        ]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    # Latest duration of every span name as text lines, slowest first
+    def summary(self):
+        lines = [f"{name}: {duration * 1000:.1f} ms"
+                 for name, duration in sorted(self.last.items(), key=lambda item: -item[1])]
+        memory = peak_memory_mb()
+        if memory is not None:
+            lines.append(f"peak memory: {memory:.0f} MB")
+        return lines
+
+# Peak resident memory of the process in MB, None when the platform does not report it
+def peak_memory_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
@@ -1,27 +1,43 @@
+import argparse
+import array
+import bisect
+import csv
+import gc
+import json
+import logging
+import multiprocessing
+import os
 import pygame
 import random
+import statistics
 import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+from multiprocessing import shared_memory
+from perf_trace import MAX_TRACE_EVENTS, PerfTrace
 
-# Initialize pygame
-pygame.init()
-WIDTH, HEIGHT = 800, 400
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("The Mario of Darwin")
-clock = pygame.time.Clock()
+try:
+    import numpy as np # Array entity store, optional
+except ImportError:
+    np = None
 
-GROUND_LEVEL = HEIGHT - 85
+STARTED = time.perf_counter() # Start of the time-to-first-frame report
 
-# Initialize Pygame and mixer
-pygame.init()
-pygame.mixer.init()
+log = logging.getLogger(__name__)
+
+WIDTH, HEIGHT = 800, 400
+GROUND_LEVEL = HEIGHT - 85
 
-# Load and play background music
-pygame.mixer.music.load("assets/sounds/background_music.mp3")
-pygame.mixer.music.set_volume(0.5)
-pygame.mixer.music.play(-1) 
+# Rendering mode, dirty rects only redraw and update the screen areas that changed each frame
+# instead of the whole window, set MARIO_DIRTY_RECTS=1 to turn it on
+DIRTY_RECTS = os.environ.get("MARIO_DIRTY_RECTS", "0") == "1"
 
-shoot_sound = pygame.mixer.Sound("assets/sounds/hit.mp3")
-shoot_sound.set_volume(0.3)
+# Entity store, arrays keep bullets, enemies and collectibles in NumPy arrays updated in batches
+# instead of one sprite object each, set MARIO_ENTITY_ARRAYS=1 to turn it on (ignored without numpy)
+ENTITY_ARRAYS = os.environ.get("MARIO_ENTITY_ARRAYS", "0") == "1" and np is not None
 
 # Colors
 WHITE = (255, 255, 255)
@@ -31,27 +47,271 @@ GREEN = (0, 255, 0)
 YELLOW= (255, 255, 0)
 BLUE  = (0, 100, 255)
 
-background_img = pygame.image.load("assets/images/background.jpg").convert()
-background_img = pygame.transform.scale(background_img, (WIDTH, HEIGHT))
-player_img = pygame.image.load("assets/images/player.png").convert_alpha()
-enemy_img = pygame.image.load("assets/images/enemy.png").convert_alpha()
-boss_img = pygame.image.load("assets/images/boss.png").convert_alpha()
-bullet_img = pygame.image.load("assets/images/bullet.png").convert_alpha()
-bullet_img = pygame.transform.scale(bullet_img, (20, 10))
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+ASSET_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".asset_cache") # Scaled images and decoded sounds
+MUSIC_FILE = "background_music.mp3" # Streamed, decoding minutes of music up front would cost tens of MB
+AUDIO_FREQUENCY = 44100
+AUDIO_BUFFER = 512 # Samples mixed at a time, about 12 ms at 44.1 kHz, smaller buffers crackle on slow machines
+# Sound category -> mixer channels reserved for it, a sound played while they are all busy
+# takes over the one that started first
+SOUND_CHANNELS = {
+    "weapon": 4,
+}
+FREE_CHANNELS = 8 # Mixer channels left over for Sound.play() without a category
+# Image name -> (file, size it is drawn at, has transparency)
+IMAGE_ASSETS = {
+    "background": ("background.jpg", (WIDTH, HEIGHT), False),
+    "player": ("player.png", (50, 50), True),
+    "enemy": ("enemy.png", (50, 50), True),
+    "boss": ("boss.png", (100, 100), True),
+    "bullet": ("bullet.png", (20, 10), True),
+}
+# Sound name -> (file, volume, category)
+SOUND_ASSETS = {
+    "shoot": ("hit.mp3", 0.3, "weapon"),
+}
+COLLECTIBLE_COLORS = {'health': BLUE, 'life': YELLOW} # Collectibles are plain squares
+
+# Images and sounds of the game, looked up by name in images and sounds once loaded.
+# load() decodes the files and can run on a background thread, finish() converts the images
+# for the display and has to run on the main thread after it
+class Assets:
+    def __init__(self):
+        self.images = {}
+        self.sounds = {}
+        self.decoded = {} # Image name -> surface still in its file format
+        self.loaded = 0 # Assets done so far, for the loading screen
+        self.total = len(IMAGE_ASSETS) + len(SOUND_ASSETS)
+        self.cached = 0 # Images read from the disk cache instead of decoded
+
+    def load(self, sounds=True):
+        font_path() # Font lookup can shell out to fc-list, better here than on the first HUD draw
+        for name, (file_name, size, alpha) in IMAGE_ASSETS.items():
+            self.decoded[name] = self.load_image(name, file_name, size, alpha)
+            self.loaded += 1
+        if sounds:
+            self.load_sounds()
+
+    # Needs the mixer started, sounds are decoded to its sample format
+    def load_sounds(self):
+        for name, (file_name, volume, _) in SOUND_ASSETS.items():
+            self.sounds[name] = self.load_sound(name, file_name)
+            self.sounds[name].set_volume(volume)
+            self.loaded += 1
+
+    # Decoded samples from the disk cache when they were made from the current file for the
+    # current mixer format, otherwise decoded and written to the cache like the images
+    def load_sound(self, name, file_name):
+        path = os.path.join(ASSET_DIR, "sounds", file_name)
+        frequency, size, channels = pygame.mixer.get_init()
+        key = f"{os.stat(path).st_mtime_ns} {frequency} {size} {channels}\n".encode()
+        cache_path = os.path.join(ASSET_CACHE_DIR, name + ".pcm")
+        try:
+            with open(cache_path, "rb") as file:
+                if file.readline() == key:
+                    return pygame.mixer.Sound(buffer=file.read())
+        except OSError:
+            pass
+
+        sound = pygame.mixer.Sound(path)
+        try:
+            os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+            with open(cache_path + ".tmp", "wb") as file:
+                file.write(key)
+                file.write(sound.get_raw())
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError:
+            pass
+        return sound
+
+    # Scaled image from the disk cache when it was made from the current file, otherwise decoded,
+    # scaled and written to the cache for the next launch
+    def load_image(self, name, file_name, size, alpha):
+        path = os.path.join(ASSET_DIR, "images", file_name)
+        mode = "RGBA" if alpha else "RGB"
+        key = f"{os.stat(path).st_mtime_ns} {size[0]} {size[1]} {mode}\n".encode()
+        cache_path = os.path.join(ASSET_CACHE_DIR, name + ".raw")
+        try:
+            with open(cache_path, "rb") as file:
+                if file.readline() == key:
+                    data = file.read()
+                    if len(data) == size[0] * size[1] * len(mode):
+                        self.cached += 1
+                        return pygame.image.frombytes(data, size, mode)
+        except OSError:
+            pass
+
+        picture = pygame.transform.scale(pygame.image.load(path), size)
+        try:
+            os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+            with open(cache_path + ".tmp", "wb") as file:
+                file.write(key)
+                file.write(pygame.image.tobytes(picture, mode))
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError:
+            pass # Cache is optional, a read-only install decodes every launch
+        return picture
+
+    def finish(self):
+        for name, (_, _, alpha) in IMAGE_ASSETS.items():
+            picture = self.decoded.pop(name)
+            self.images[name] = picture.convert_alpha() if alpha else picture.convert()
+        for kind, color in COLLECTIBLE_COLORS.items():
+            self.images[kind] = pygame.Surface((20, 20))
+            self.images[kind].fill(color)
+
+assets = Assets()
+
+# Nothing opens a window or the sound device at import, open_window() and start_audio() do that
+screen = None
+clock = None
+frame_rate = None # Frames drawn per second at most, the display's refresh rate, sprites are interpolated between ticks
+
+def open_window():
+    global screen, clock, frame_rate
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("The Mario of Darwin")
+    clock = pygame.time.Clock()
+    frame_rate = display_refresh_rate()
+
+# Refresh rate of the display the window is on, DEFAULT_FRAME_RATE when pygame cannot tell
+# (get_current_refresh_rate() only exists in pygame-ce)
+def display_refresh_rate():
+    get_refresh_rate = getattr(pygame.display, "get_current_refresh_rate", None)
+    try:
+        rate = get_refresh_rate() if get_refresh_rate else 0
+    except pygame.error:
+        rate = 0
+    return rate or DEFAULT_FRAME_RATE
+
+# Sound effects play on channels reserved for their category instead of whichever channel is free,
+# so rapid fire cannot take the channels of other sounds, and a new shot is never dropped
+class AudioManager:
+    def __init__(self):
+        self.voices = {} # Category -> [channel, time it started playing] for each of its channels
+        self.plays = 0
+        self.steals = 0 # Sounds cut off to play a newer one
+
+    # Open the sound device, the buffer size has to be set here, before anything starts the mixer
+    def start(self, buffer=AUDIO_BUFFER):
+        pygame.mixer.init(AUDIO_FREQUENCY, -16, 2, buffer)
+        reserved = sum(SOUND_CHANNELS.values())
+        pygame.mixer.set_num_channels(reserved + FREE_CHANNELS)
+        pygame.mixer.set_reserved(reserved) # Sound.play() without a channel only picks from the free ones
+        first = 0
+        for category, count in SOUND_CHANNELS.items():
+            self.voices[category] = [[pygame.mixer.Channel(first + i), 0.0] for i in range(count)]
+            first += count
+
+    def stop(self):
+        pygame.mixer.quit()
+        self.voices = {}
+
+    def play(self, name):
+        voices = self.voices.get(SOUND_ASSETS[name][2])
+        if not voices:
+            return # No sound device
+        voice = next((voice for voice in voices if not voice[0].get_busy()), None)
+        if voice is None:
+            voice = min(voices, key=lambda voice: voice[1])
+            self.steals += 1
+        voice[0].play(assets.sounds[name])
+        voice[1] = time.perf_counter()
+        self.plays += 1
+
+audio = AudioManager()
+
+def start_audio():
+    audio.start()
+
+def start_music():
+    pygame.mixer.music.load(os.path.join(ASSET_DIR, "sounds", MUSIC_FILE))
+    pygame.mixer.music.set_volume(0.5)
+    pygame.mixer.music.play(-1) 
+
+# Load everything on this thread, for benchmarks and tools that do not show a loading screen
+def load_assets_now(sounds=False):
+    assets.load(sounds)
+    assets.finish()
+
+TEXT_CACHE_SIZE = 128 # Rendered text surfaces kept for reuse
+
+# Font file looked up on first use, match_font can take a while
+@lru_cache(maxsize=None)
+def font_path():
+    return pygame.font.match_font('arial')
 
-# Fonts
-font_name = pygame.font.match_font('arial')
+# Font is loaded once per size instead of parsing the TTF on every draw
+@lru_cache(maxsize=None)
+def get_font(size):
+    return pygame.font.Font(font_path(), size)
 
+# Rendered text surfaces are reused while the text, size and color stay the same
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(text, size, color):
+    return get_font(size).render(text, True, color)
+
+# Digits rendered once per size and color, numbers are composed from them
+@lru_cache(maxsize=None)
+def digit_atlas(size, color):
+    return [render_text(str(digit), size, color) for digit in range(10)]
+
+# Text helpers return the screen area they drew on
 def draw_text(text, size, color, x, y):
-    font = pygame.font.Font(font_name, size)
-    surface = font.render(text, True, color)
-    screen.blit(surface, (x, y))
+    return screen.blit(render_text(text, size, color), (x, y))
+
+# Draw "label: value" for HUD counters that change often without rendering a new surface for every value
+def draw_counter(label, value, size, color, x, y):
+    label_surface = render_text(f"{label}: ", size, color)
+    area = screen.blit(label_surface, (x, y))
+    x += label_surface.get_width()
+    if value < 0:
+        minus = render_text("-", size, color)
+        screen.blit(minus, (x, y))
+        x += minus.get_width()
+    digits = digit_atlas(size, color)
+    for digit in str(abs(value)):
+        glyph = digits[int(digit)]
+        screen.blit(glyph, (x, y))
+        x += glyph.get_width()
+    area.width = x - area.x
+    return area
+
+POOL_LIMIT = 256 # Killed sprites kept per class for reuse
+
+# Sprites spawned and killed all the time are recycled instead of allocated again
+# spawn() takes the same arguments as the class and reuses a killed sprite through reset()
+class PooledSprite(pygame.sprite.Sprite):
+    pool = None # List of killed sprites, every subclass sets its own
+    pool_limit = POOL_LIMIT # Killed sprites kept in each pool
+    constructed = 0 # Sprites built because no pooled one was free, reported by --soak
+
+    def __init__(self, *args):
+        super().__init__()
+        PooledSprite.constructed += 1
+        self.reset(*args)
+
+    @classmethod
+    def spawn(cls, *args):
+        if cls.pool:
+            sprite = cls.pool.pop()
+            sprite.reset(*args)
+            return sprite
+        return cls(*args)
+
+    def kill(self):
+        alive = self.alive()
+        super().kill()
+        if alive and len(self.pool) < self.pool_limit:
+            self.pool.append(self)
 
 # Player class
 class Player(pygame.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.image = pygame.transform.scale(player_img, (50, 50))
+        self.image = assets.images["player"]
         self.rect = self.image.get_rect()
         self.rect.center = (100, HEIGHT - 300)
         self.speed = 5
@@ -61,14 +321,15 @@ class Player(pygame.sprite.Sprite):
         self.health = 100
         self.lives = 3
 
-    def update(self, keys):
+    # inputs are the INPUT_* bits of this tick
+    def update(self, inputs):
         dx = 0
-        if keys[pygame.K_LEFT]:
+        if inputs & INPUT_LEFT:
             dx = -self.speed
-        if keys[pygame.K_RIGHT]:
+        if inputs & INPUT_RIGHT:
             dx = self.speed
 
-        if keys[pygame.K_UP] and self.on_ground:
+        if inputs & INPUT_JUMP and self.on_ground:
             self.vel_y = -15
             self.on_ground = False
 
@@ -99,15 +360,18 @@ class Player(pygame.sprite.Sprite):
         return False
 
 # Projectile class
-class Projectile(pygame.sprite.Sprite):
-    def __init__(self, x, y):
-        super().__init__()
-        self.image = bullet_img
+class Projectile(PooledSprite):
+    pool = []
+    SPEED = 10
+    DAMAGE = 2
+
+    def reset(self, x, y):
+        self.image = assets.images["bullet"]
 
         self.rect = self.image.get_rect()
         self.rect.center = (x, y)
-        self.speed = 10
-        self.damage = 2
+        self.speed = Projectile.SPEED
+        self.damage = Projectile.DAMAGE
 
     def update(self):
         self.rect.x += self.speed
@@ -115,16 +379,22 @@ class Projectile(pygame.sprite.Sprite):
             self.kill()
 
 # Enemy class
-class Enemy(pygame.sprite.Sprite):
-    def __init__(self, level=1):
-        super().__init__()
-        self.image = pygame.transform.scale(enemy_img, (50, 50))
+class Enemy(PooledSprite):
+    pool = []
+    HEALTH = 1  # Regular enemies take 1 hit to die
+
+    def reset(self, level, rng):
+        self.image = assets.images["enemy"]
         self.rect = self.image.get_rect()
         self.rect.x = WIDTH + 10
         self.rect.y = GROUND_LEVEL - 50
         
-        self.speed = random.randint(2 + level, 4 + level)
-        self.health = 1  # Regular enemies take 1 hit to die
+        self.speed = Enemy.random_speed(level, rng)
+        self.health = Enemy.HEALTH
+
+    @staticmethod
+    def random_speed(level, rng):
+        return rng.randint(2 + level, 4 + level)
 
     def update(self):
         self.rect.x -= self.speed
@@ -135,7 +405,7 @@ class Enemy(pygame.sprite.Sprite):
 class BossEnemy(pygame.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.image = pygame.transform.scale(boss_img, (100, 100))
+        self.image = assets.images["boss"]
         self.rect = self.image.get_rect()
         self.rect.x = WIDTH + 10
         self.rect.y = GROUND_LEVEL - 100
@@ -146,185 +416,1427 @@ class BossEnemy(pygame.sprite.Sprite):
         self.rect.x -= self.speed
 
 # Collectible class
-class Collectible(pygame.sprite.Sprite):
-    def __init__(self, kind):
-        super().__init__()
+class Collectible(PooledSprite):
+    pool = []
+    SPEED = 3
+
+    def reset(self, kind, rng):
         self.kind = kind
-        self.image = pygame.Surface((20, 20))
-        if kind == 'health':
-            self.image.fill(BLUE)
-        else:
-            self.image.fill(YELLOW)
+        self.image = assets.images[kind]
         self.rect = self.image.get_rect()
-        self.rect.x = random.randint(WIDTH + 20, WIDTH + 200)
-        self.rect.y = random.randint(HEIGHT - 200, HEIGHT - 120)
-        self.speed = 3
+        self.rect.topleft = Collectible.random_position(rng)
+        self.speed = Collectible.SPEED
+
+    @staticmethod
+    def random_position(rng):
+        x = rng.randint(WIDTH + 20, WIDTH + 200)
+        return x, rng.randint(HEIGHT - 200, HEIGHT - 120)
 
     def update(self):
         self.rect.x -= self.speed
         if self.rect.right < 0:
             self.kill()
 
-def game_over_screen(win=False):
-    screen.fill(BLACK)
-    if win:
-        font = pygame.font.Font(font_name, 36)
-        text_surface = font.render("Congratulations! You defeated the Boss!", True, GREEN)
-        text_rect = text_surface.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 40))
-        screen.blit(text_surface, text_rect)
-    else:
-        font = pygame.font.Font(font_name, 48)
-        text_surface = font.render("Game Over!", True, RED)
-        text_rect = text_surface.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 40))
-        screen.blit(text_surface, text_rect)
-
-    font = pygame.font.Font(font_name, 30)
-    instruction_surface = font.render("Press R to Restart or Q to Quit", True, WHITE)
-    instruction_rect = instruction_surface.get_rect(center=(WIDTH // 2, HEIGHT // 2 + 20))
-    screen.blit(instruction_surface, instruction_rect)
-    pygame.display.flip()
-    waiting = True
-    while waiting:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_r:
-                    waiting = False
-                if event.key == pygame.K_q:
-                    pygame.quit()
-                    sys.exit()
-
-def main_game():
-    all_sprites = pygame.sprite.Group()
-    projectiles = pygame.sprite.Group()
-    enemies = pygame.sprite.Group()
-    collectibles = pygame.sprite.Group()
-    player = Player()
-    all_sprites.add(player)
-    score = 0
-    boss_spawned = False
-    boss = None
-    enemy_spawn_event = pygame.USEREVENT + 1
-    collectible_spawn_event = pygame.USEREVENT + 2
-    enemy_spawn_delay = 1000
-    collectible_spawn_delay = 5000
-
-    pygame.time.set_timer(enemy_spawn_event, enemy_spawn_delay)
-    pygame.time.set_timer(collectible_spawn_event, collectible_spawn_delay)
-
-    level = 1
-    level_score_thresholds = {1: 5, 2: 10, 3: 15}
-    level_transition_timer = 0
-    show_level_message = True
-
-    running = True
-    while running:
-        clock.tick(60)
-        keys = pygame.key.get_pressed()
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == enemy_spawn_event and not boss_spawned and not show_level_message:
-                if level == 3:
-                    if len(enemies) < 3:
-                        enemies.add(Enemy(level))
-                        all_sprites.add(enemies)
-                else:
-                    enemies.add(Enemy(level))
-                    all_sprites.add(enemies)
-
-            if event.type == collectible_spawn_event and not show_level_message:
-                kind = random.choice(['health', 'life'])
-                c = Collectible(kind)
-                collectibles.add(c)
-                all_sprites.add(c)
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    bullet_y = player.rect.top + 20
-                    bullet = Projectile(player.rect.right, bullet_y)
-                    projectiles.add(bullet)
-                    all_sprites.add(bullet)
-                    shoot_sound.play()
-
-        player.update(keys)
-        projectiles.update()
-        enemies.update()
-        collectibles.update()
-        if boss_spawned and boss and boss.alive():
-            boss.update()
-        for bullet in projectiles.copy():
-            enemy_hit = pygame.sprite.spritecollideany(bullet, enemies)
+GRID_CELL_SIZE = 64 # Broadphase cell size, about the size of the larger sprites
+
+# Uniform grid broadphase, a rect is only tested against sprites sharing one of its grid cells
+# Sprites must not move while they are in the grid, a new grid is built every frame
+class SpatialGrid:
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {} # (column, row) -> ([rects], [(insertion order, sprite)])
+        self.count = 0
+
+    def cells_of(self, rect):
+        size = self.cell_size
+        return [(cx, cy)
+                for cx in range(rect.left // size, (rect.right - 1) // size + 1)
+                for cy in range(rect.top // size, (rect.bottom - 1) // size + 1)]
+
+    def insert(self, sprite):
+        entry = (self.count, sprite) # Insertion order decides which hit comes first
+        self.count += 1
+        for cell in self.cells_of(sprite.rect):
+            rects, entries = self.cells.setdefault(cell, ([], []))
+            rects.append(sprite.rect)
+            entries.append(entry)
+
+    def insert_all(self, sprites):
+        for sprite in sprites:
+            self.insert(sprite)
+
+    # Take out a sprite killed during the collision pass so later rects do not hit it
+    def remove(self, sprite):
+        for cell in self.cells_of(sprite.rect):
+            rects, entries = self.cells[cell]
+            for index, (_, other) in enumerate(entries):
+                if other is sprite:
+                    del rects[index], entries[index]
+                    break
+
+    # First inserted sprite overlapping rect, like spritecollideany
+    def first_hit(self, rect):
+        size = self.cell_size
+        cells = self.cells
+        best = None
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    index = rect.collidelist(bucket[0]) # Lowest index is the earliest inserted in this cell
+                    if index >= 0 and (best is None or bucket[1][index][0] < best[0]):
+                        best = bucket[1][index]
+        return best[1] if best else None
+
+    # (sprite, hit) for every sprite overlapping something in the grid, found one at a time
+    # so sprites removed while handling a hit are not hit again
+    def hits(self, sprites):
+        for sprite in sprites:
+            hit = self.first_hit(sprite.rect)
+            if hit:
+                yield sprite, hit
+
+# Score, health, lives, level and help text, returns the screen areas drawn
+def draw_hud(score, player, level, show_level_message):
+    areas = [
+        draw_counter("Score", score, 22, BLACK, 10, 10),
+        draw_counter("Health", player.health, 22, GREEN, 10, 40),
+        draw_counter("Lives", player.lives, 22, BLUE, 10, 70),
+        draw_counter("Level", level, 22, BLACK, WIDTH - 120, 10),
+    ]
+    if show_level_message:
+        areas.append(draw_text(f"Level {level}", 48, BLACK, WIDTH // 2 - 60, HEIGHT // 2 - 40))
+    areas.append(draw_text("Use arrow keys to move and jump", 20, WHITE, WIDTH // 2 - 140, HEIGHT - 60))
+    areas.append(draw_text("Press SPACE to shoot", 20, WHITE, WIDTH // 2 - 100, HEIGHT - 30))
+    return areas
+
+TICK_RATE = 60 # Simulation ticks per second, independent of the frame rate
+TICK_SECONDS = 1 / TICK_RATE
+DEFAULT_FRAME_RATE = 60 # Frames drawn per second when the display's refresh rate is unknown
+MAX_TICKS_PER_FRAME = 5 # Ticks run to catch up after a long frame, beyond that the game slows down
+LEVEL_SCORE_THRESHOLDS = {1: 5, 2: 10, 3: 15}
+BENCHMARK_SEED = 137 # Seed of the scripted benchmark playthrough
+STRESS_TICKS = 300 # Ticks timed by the --stress benchmark
+STRESS_ENEMIES = 50 # Enemies kept on screen by the --stress benchmark
+SOAK_JUMP_TICKS = 45 # The --soak player jumps this often and shoots every tick
+COLLISION_SCENARIOS = ((50, 5), (300, 30), (1000, 60)) # (bullets, enemies) timed by --collision-benchmark
+COLLISION_FRAMES = 200 # Frames timed for each scenario
+RENDER_BENCHMARK_FRAMES = 900 # Frames of the scripted game drawn by --render-benchmark in each mode
+IDLE_BENCHMARK_SECONDS = 3 # Time each screen is left alone by --idle-benchmark
+HUD_BENCHMARK_FRAMES = 2000 # HUD draws timed by --hud-benchmark for each text path
+
+# Bits of the per-tick input, a game is replayed from its seed and the list of these
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+INPUT_SHOOT = 8
+
+def ms_to_ticks(ms):
+    return ms * TICK_RATE // 1000
+
+# Game state and rules advanced one fixed tick at a time by step(), with no clock, keyboard or
+# display access, so the same seed and inputs always play out the same way
+class Game:
+    # trace gets spans for the phases of every tick, see FrameProfiler
+    def __init__(self, seed, trace=None):
+        self.seed = seed
+        self.trace = trace if trace is not None else NO_TRACE
+        self.rng = random.Random(seed)
+        self.all_sprites = pygame.sprite.Group()
+        self.projectiles = pygame.sprite.Group()
+        self.enemies = pygame.sprite.Group()
+        self.collectibles = pygame.sprite.Group()
+        self.player = Player()
+        self.add_sprite(self.player)
+        self.score = 0
+        self.boss = None
+        self.level = 1
+        self.tick = 0
+        # Spawns happen on tick counts instead of wall clock timers
+        self.enemy_spawn_ticks = ms_to_ticks(1000)
+        self.collectible_spawn_ticks = ms_to_ticks(5000)
+        self.next_enemy_tick = self.enemy_spawn_ticks
+        self.next_collectible_tick = self.collectible_spawn_ticks
+        self.show_level_message = True
+        self.level_message_until = ms_to_ticks(2000)
+
+    # Sprites start where they spawn, with no motion to interpolate
+    def add_sprite(self, sprite, group=None):
+        sprite.previous = sprite.rect.topleft
+        self.all_sprites.add(sprite)
+        if group is not None:
+            group.add(sprite)
+
+    def boss_alive(self):
+        return self.boss is not None and self.boss.alive()
+
+    # Advance one tick, returns "win" or "lose" when the game ends, otherwise None
+    def step(self, inputs):
+        self.tick += 1
+        self.remember_positions()
+        trace = self.trace
+        player = self.player
+
+        with trace.span("spawn"):
+            if self.tick == self.next_enemy_tick:
+                self.next_enemy_tick += self.enemy_spawn_ticks
+                if self.boss is None and not self.show_level_message:
+                    if self.level != 3 or len(self.enemies) < 3:
+                        self.spawn_enemy()
+
+            if self.tick == self.next_collectible_tick:
+                self.next_collectible_tick += self.collectible_spawn_ticks
+                if not self.show_level_message:
+                    self.spawn_collectible(self.rng.choice(['health', 'life']))
+
+            if inputs & INPUT_SHOOT:
+                self.fire(player.rect.right, player.rect.top + 20)
+
+        with trace.span("move"):
+            player.update(inputs)
+            self.move_entities()
+            boss = self.boss
+            if self.boss_alive():
+                boss.update()
+
+        with trace.span("collisions"):
+            result = self.resolve_collisions()
+        if result:
+            return result
+
+        if self.boss_alive() and player.rect.colliderect(boss.rect):
+            return "lose"
+
+        if self.show_level_message and self.tick > self.level_message_until:
+            self.show_level_message = False
+
+        if not self.show_level_message and self.level < 3 and self.score >= LEVEL_SCORE_THRESHOLDS[self.level]:
+            self.level += 1
+            self.show_level_message = True
+            self.level_message_until = self.tick + ms_to_ticks(2000)
+
+            if self.level == 2:
+                self.enemy_spawn_ticks = ms_to_ticks(800)
+            elif self.level == 3:
+                self.enemy_spawn_ticks = ms_to_ticks(1500)
+            self.next_enemy_tick = self.tick + self.enemy_spawn_ticks
+
+        if self.level == 3 and self.score >= LEVEL_SCORE_THRESHOLDS[3] and self.boss is None:
+            self.boss = BossEnemy()
+            self.add_sprite(self.boss)
+        return None
+
+    def remember_positions(self):
+        for sprite in self.all_sprites:
+            sprite.previous = sprite.rect.topleft # Where the renderer interpolates from
+
+    def spawn_enemy(self):
+        self.add_sprite(Enemy.spawn(self.level, self.rng), self.enemies)
+
+    def spawn_collectible(self, kind):
+        self.add_sprite(Collectible.spawn(kind, self.rng), self.collectibles)
+
+    # x is the left end of the bullet, y its middle
+    def fire(self, x, y):
+        self.add_sprite(Projectile.spawn(x, y), self.projectiles)
+
+    # Move bullets, enemies and collectibles and drop the ones that left the screen
+    def move_entities(self):
+        self.projectiles.update()
+        self.enemies.update()
+        self.collectibles.update()
+
+    # Bullets against enemies and the boss, then the player against enemies and collectibles
+    def resolve_collisions(self):
+        player = self.player
+        boss = self.boss
+        # Broadphase grids of what bullets and the player can hit, enemies come before the boss
+        shootables = SpatialGrid()
+        shootables.insert_all(self.enemies)
+        if self.boss_alive():
+            shootables.insert(boss)
+        pickups = SpatialGrid()
+        pickups.insert_all(self.collectibles)
+
+        for bullet, target in shootables.hits(self.projectiles.sprites()):
+            target.health -= bullet.damage
+            bullet.kill()
+            if target is boss:
+                log.debug("Boss health now: %d", boss.health)
+                if boss.health <= 0:
+                    boss.kill()
+                    return "win"
+            elif target.health <= 0:
+                shootables.remove(target)
+                target.kill()
+                self.score += 1
+
+        enemy_hit = shootables.first_hit(player.rect)
+        if enemy_hit is boss:
+            enemy_hit = None # Touching the boss is handled in step()
+        if enemy_hit:
+            if player.damage(20):
+                return "lose"
+            enemy_hit.kill()
+
+        collect_hit = pickups.first_hit(player.rect)
+        if collect_hit:
+            self.collect(collect_hit.kind)
+            collect_hit.kill()
+        return None
+
+    def collect(self, kind):
+        if kind == 'health':
+            self.player.health = min(self.player.health + 30, 100)
+        else:
+            self.player.lives += 1
+
+    # (image, position) of everything to draw, positions interpolated by alpha between the last two ticks
+    def blit_sequence(self, alpha):
+        return [(sprite.image, interpolated_position(sprite, alpha)) for sprite in self.all_sprites]
+
+    # (x, y, width, height) of every entity, in no particular order
+    def entity_rects(self):
+        return [tuple(sprite.rect) for sprite in self.all_sprites]
+
+    # Top left corners of the first count enemies, the oldest are the closest to the player
+    def enemy_positions(self, count):
+        return [sprite.rect.topleft for sprite in self.enemies.sprites()[:count]]
+
+    # (x, y, kind number) of the oldest collectible, None when there is none
+    def first_collectible(self):
+        for sprite in self.collectibles:
+            return sprite.rect.x, sprite.rect.y, COLLECTIBLE_KINDS.index(sprite.kind)
+        return None
+
+    # Everything that decides how the game continues, equal between a run and its replay
+    def snapshot(self):
+        return (self.tick, self.score, self.level, self.player.health, self.player.lives,
+                self.player.vel_y, self.boss.health if self.boss else None,
+                sorted(self.entity_rects()), self.rng.getstate())
+
+ENTITY_CAPACITY = 256 # Starting slots of an EntityArrays store, doubled when full
+
+# Struct-of-arrays store for many same-size entities moving sideways, entity i is slot i
+# of every array and entities stay in spawn order like in a sprite group
+class EntityArrays:
+    FIELDS = ("x", "y", "previous_x", "speed", "health", "damage", "kind")
+
+    def __init__(self, size, images):
+        self.width, self.height = size
+        self.images = images # Image for each kind
+        self.count = 0
+        for name in EntityArrays.FIELDS:
+            setattr(self, name, np.zeros(ENTITY_CAPACITY, np.int64))
+
+    def __len__(self):
+        return self.count
+
+    # x and y are the top left corner, speed is pixels per tick to the right
+    def add(self, x, y, speed, health=0, damage=0, kind=0):
+        if self.count == len(self.x):
+            for name in EntityArrays.FIELDS:
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        i = self.count
+        self.x[i] = self.previous_x[i] = x
+        self.y[i] = y
+        self.speed[i] = speed
+        self.health[i] = health
+        self.damage[i] = damage
+        self.kind[i] = kind
+        self.count += 1
+
+    # Keep the entities where keep is True, in the same order
+    def keep(self, keep):
+        count = int(np.count_nonzero(keep))
+        for name in EntityArrays.FIELDS:
+            array = getattr(self, name)
+            array[:count] = array[:self.count][keep]
+        self.count = count
+
+    def remove(self, indices):
+        keep = np.ones(self.count, bool)
+        keep[indices] = False
+        self.keep(keep)
+
+    def move(self):
+        x = self.x[:self.count]
+        self.previous_x[:self.count] = x
+        x += self.speed[:self.count]
+
+    # Mask of the entities overlapping a rect, the same test as Rect.colliderect
+    def overlapping(self, rect):
+        x = self.x[:self.count]
+        y = self.y[:self.count]
+        return (x < rect.right) & (x + self.width > rect.left) & (y < rect.bottom) & (y + self.height > rect.top)
+
+    def rect(self, i):
+        return pygame.Rect(int(self.x[i]), int(self.y[i]), self.width, self.height)
+
+    def blit_sequence(self, alpha):
+        count = self.count
+        x = self.previous_x[:count] + (self.x[:count] - self.previous_x[:count]) * alpha
+        positions = zip(np.rint(x).astype(np.int64).tolist(), self.y[:count].tolist())
+        if len(self.images) == 1:
+            image = self.images[0]
+            return [(image, position) for position in positions]
+        images = self.images
+        return [(images[kind], position) for kind, position in zip(self.kind[:count].tolist(), positions)]
+
+    def entity_rects(self):
+        return [(x, y, self.width, self.height) for x, y in zip(self.x[:self.count].tolist(), self.y[:self.count].tolist())]
+
+COLLECTIBLE_KINDS = ['health', 'life'] # Kind numbers of collectibles in an EntityArrays store
+
+# Same rules as Game with bullets, enemies and collectibles kept in NumPy arrays and moved, culled
+# and hit-tested in batches, the player and the boss stay sprites, needs numpy
+class ArrayGame(Game):
+    def __init__(self, seed, trace=None):
+        super().__init__(seed, trace)
+        images = assets.images
+        self.projectiles = EntityArrays(images["bullet"].get_size(), [images["bullet"]])
+        self.enemies = EntityArrays(images["enemy"].get_size(), [images["enemy"]])
+        self.collectibles = EntityArrays((20, 20), [images[kind] for kind in COLLECTIBLE_KINDS])
+
+    def spawn_enemy(self):
+        self.enemies.add(WIDTH + 10, GROUND_LEVEL - 50, -Enemy.random_speed(self.level, self.rng), health=Enemy.HEALTH)
+
+    def spawn_collectible(self, kind):
+        x, y = Collectible.random_position(self.rng)
+        self.collectibles.add(x, y, -Collectible.SPEED, kind=COLLECTIBLE_KINDS.index(kind))
+
+    def fire(self, x, y):
+        x, y = assets.images["bullet"].get_rect(center=(x, y)).topleft
+        self.projectiles.add(x, y, Projectile.SPEED, damage=Projectile.DAMAGE)
+
+    def move_entities(self):
+        for store in (self.projectiles, self.enemies, self.collectibles):
+            store.move()
+        self.projectiles.keep(self.projectiles.x[:len(self.projectiles)] <= WIDTH)
+        for store in (self.enemies, self.collectibles):
+            store.keep(store.x[:len(store)] + store.width >= 0)
+
+    # Bullets hitting a target, in order, from the ones not used yet until its health runs out
+    def hitters(self, target, health, used):
+        hits = np.flatnonzero(self.projectiles.overlapping(target) & ~used)
+        damage = np.cumsum(self.projectiles.damage[hits])
+        return hits[:np.searchsorted(damage, health) + 1]
+
+    def resolve_collisions(self):
+        bullets = self.projectiles
+        enemies = self.enemies
+        player = self.player
+        boss = self.boss
+        # The sprite game sends each bullet at the earliest spawned target it touches that is still alive.
+        # Going through targets in spawn order, each takes the first unused bullets touching it, which
+        # gives the same hits with one array pass per target instead of one grid lookup per bullet
+        used = np.zeros(len(bullets), bool)
+        enemy_hits = []
+        for i in range(len(enemies)):
+            hits = self.hitters(enemies.rect(i), enemies.health[i], used)
+            used[hits] = True
+            enemy_hits.append(hits)
+        end = len(bullets) # Bullets from here on come after the boss died and never fly
+        if self.boss_alive():
+            for bullet in self.hitters(boss.rect, boss.health, used).tolist():
+                used[bullet] = True
+                boss.health -= int(bullets.damage[bullet])
+                log.debug("Boss health now: %d", boss.health)
+                if boss.health <= 0:
+                    end = bullet
+        used[end + 1:] = False
+
+        dead = []
+        for i, hits in enumerate(enemy_hits):
+            hits = hits[hits < end]
+            if len(hits):
+                enemies.health[i] -= bullets.damage[hits].sum()
+                if enemies.health[i] <= 0:
+                    dead.append(i)
+        bullets.keep(~used)
+        enemies.remove(dead)
+        self.score += len(dead)
+        if end < len(used):
+            boss.kill()
+            return "win"
+
+        touching = np.flatnonzero(enemies.overlapping(player.rect))
+        if len(touching):
+            if player.damage(20):
+                return "lose"
+            enemies.remove(touching[0])
+
+        touching = np.flatnonzero(self.collectibles.overlapping(player.rect))
+        if len(touching):
+            self.collect(COLLECTIBLE_KINDS[self.collectibles.kind[touching[0]]])
+            self.collectibles.remove(touching[0])
+        return None
+
+    def blit_sequence(self, alpha):
+        sequence = super().blit_sequence(alpha)
+        for store in (self.collectibles, self.enemies, self.projectiles):
+            sequence += store.blit_sequence(alpha)
+        return sequence
+
+    def enemy_positions(self, count):
+        count = min(count, len(self.enemies))
+        return list(zip(self.enemies.x[:count].tolist(), self.enemies.y[:count].tolist()))
+
+    def first_collectible(self):
+        if not len(self.collectibles):
+            return None
+        return int(self.collectibles.x[0]), int(self.collectibles.y[0]), int(self.collectibles.kind[0])
+
+    def entity_rects(self):
+        rects = super().entity_rects()
+        for store in (self.projectiles, self.enemies, self.collectibles):
+            rects += store.entity_rects()
+        return rects
+
+# Game with the entity store picked by ENTITY_ARRAYS
+# Collisions resolved the way they were before the grid broadphase, every bullet tested against every
+# enemy through a copy of the projectile group, compared against Game by --collision-benchmark
+class BruteForceGame(Game):
+    def resolve_collisions(self):
+        player = self.player
+        boss = self.boss
+        for bullet in self.projectiles.copy():
+            enemy_hit = pygame.sprite.spritecollideany(bullet, self.enemies)
             if enemy_hit:
                 enemy_hit.health -= bullet.damage
                 bullet.kill()
                 if enemy_hit.health <= 0:
                     enemy_hit.kill()
-                    score += 1
+                    self.score += 1
                 continue
-            if boss_spawned and boss and boss.alive():
-                if boss.rect.colliderect(bullet.rect):
-                    boss.health -= bullet.damage
-                    bullet.kill()
-                    print(f"Boss health now: {boss.health}") 
-                    if boss.health <= 0:
-                        boss.kill()
-                        game_over_screen(win=True)
-                        return
-        enemy_hit = pygame.sprite.spritecollideany(player, enemies)
+            if self.boss_alive() and boss.rect.colliderect(bullet.rect):
+                boss.health -= bullet.damage
+                bullet.kill()
+                if boss.health <= 0:
+                    boss.kill()
+                    return "win"
+
+        enemy_hit = pygame.sprite.spritecollideany(player, self.enemies)
         if enemy_hit:
             if player.damage(20):
-                game_over_screen()
-                return
+                return "lose"
             enemy_hit.kill()
 
-        collect_hit = pygame.sprite.spritecollideany(player, collectibles)
+        collect_hit = pygame.sprite.spritecollideany(player, self.collectibles)
         if collect_hit:
-            if collect_hit.kind == 'health':
-                player.health = min(player.health + 30, 100)
-            else:
-                player.lives += 1
+            self.collect(collect_hit.kind)
             collect_hit.kill()
+        return None
+
+def new_game(seed, trace=None):
+    return ArrayGame(seed, trace) if ENTITY_ARRAYS else Game(seed, trace)
+
+FRAME_PHASES = ("wait", "input", "simulate", "draw", "present") # Timed parts of every frame of the game loop
+PROFILE_HISTORY = 240 # Frame times kept for the overlay
+PROFILE_OVERLAY_MS = 250 # Overlay text is rebuilt this often, not every frame
+FRAME_TIME_BUCKETS = (4, 8, 12, 16.7, 25, 33.3, 50) # Upper ends of the histogram bars in ms, one more bar above
+PROFILE_CSV_FIELDS = ("frame", "frame_ms") + tuple(f"{phase}_ms" for phase in FRAME_PHASES) + (
+    "ticks", "bullets", "enemies", "collectibles")
+
+NO_TRACE = PerfTrace(enabled=False) # Games without a profiler
+
+# Times the phases of every frame of the game loop, and of every tick in Game.step() as nested spans.
+# F3 shows an overlay with FPS, a frame time histogram and entity counts, trace_path gets a Chrome trace
+# and csv_path one row per frame when the game closes. With all of that off, spans are PerfTrace's no-ops
+class FrameProfiler:
+    def __init__(self):
+        self.trace = PerfTrace(enabled=False)
+        self.visible = False
+        self.trace_path = None
+        self.csv_path = None
+        self.rows = deque(maxlen=MAX_TRACE_EVENTS)
+        self.frames = 0 # Frames recorded so far, numbers the CSV rows after old ones left the deque
+        self.frame_times = deque(maxlen=PROFILE_HISTORY)
+        self.last_frame = None
+        self.overlay = None
+        self.overlay_built = 0.0
+
+    def configure(self, trace_path=None, csv_path=None):
+        self.trace_path = trace_path
+        self.csv_path = csv_path
+        self.update_enabled()
+
+    def update_enabled(self):
+        self.trace.enabled = self.visible or bool(self.trace_path or self.csv_path)
+        self.last_frame = None
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.update_enabled()
 
-        if boss_spawned and boss and boss.alive() and player.rect.colliderect(boss.rect):
-            game_over_screen()
+    def span(self, name):
+        return self.trace.span(name)
+
+    # Called at the end of every frame with the number of ticks it simulated
+    def end_frame(self, game, ticks):
+        if not self.trace.enabled:
             return
+        now = time.perf_counter()
+        if self.last_frame is not None:
+            self.frame_times.append(now - self.last_frame)
+        self.last_frame = now
+        if self.csv_path and self.frame_times:
+            last = self.trace.last
+            self.rows.append([self.frames, round(self.frame_times[-1] * 1000, 3)]
+                             + [round(last.get(phase, 0) * 1000, 3) for phase in FRAME_PHASES]
+                             + [ticks, len(game.projectiles), len(game.enemies), len(game.collectibles)])
+            self.frames += 1
+
+    # Draw the overlay in the top right corner, returns the screen area it covers
+    def draw_overlay(self, game):
+        now = time.perf_counter()
+        if self.overlay is None or now - self.overlay_built > PROFILE_OVERLAY_MS / 1000:
+            self.overlay = self.build_overlay(game)
+            self.overlay_built = now
+        return screen.blit(self.overlay, (WIDTH - self.overlay.get_width() - 10, 40))
+
+    # Text changes every time, so it is rendered here with the font directly instead of through render_text
+    def build_overlay(self, game):
+        font = get_font(16)
+        times = self.frame_times
+        average = sum(times) / len(times) if times else 0
+        lines = [f"FPS {1 / average:.0f}   frame {average * 1000:.1f} ms" if average else "FPS -"]
+        lines += [f"{phase} {self.trace.last.get(phase, 0) * 1000:.2f} ms" for phase in FRAME_PHASES]
+        lines.append(f"bullets {len(game.projectiles)}  enemies {len(game.enemies)}  items {len(game.collectibles)}")
+        if game.boss_alive():
+            lines.append(f"boss health {game.boss.health}")
+        texts = [font.render(line, True, WHITE) for line in lines]
+        histogram_height = 40
+        width = max(text.get_width() for text in texts) + 10
+        height = sum(text.get_height() for text in texts) + histogram_height + 15
+        overlay = pygame.Surface((width, height), pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, 170))
+        y = 5
+        for text in texts:
+            overlay.blit(text, (5, y))
+            y += text.get_height()
+
+        # Frame time histogram, green bars are within 60 FPS, red ones slower than 30 FPS
+        counts = [0] * (len(FRAME_TIME_BUCKETS) + 1)
+        for seconds in times:
+            counts[bisect.bisect_left(FRAME_TIME_BUCKETS, seconds * 1000)] += 1
+        bar_width = (width - 10) // len(counts)
+        most = max(counts) or 1
+        for i, count in enumerate(counts):
+            bar_height = histogram_height * count // most
+            color = GREEN if i < 4 else YELLOW if i < 6 else RED
+            pygame.draw.rect(overlay, color, (5 + i * bar_width, y + 5 + histogram_height - bar_height,
+                                              bar_width - 2, bar_height))
+        return overlay
+
+    # Write the trace and the CSV that were asked for
+    def save(self):
+        try:
+            if self.trace_path:
+                self.trace.export(self.trace_path)
+            if self.csv_path:
+                with open(self.csv_path, "w", newline="") as file:
+                    writer = csv.writer(file)
+                    writer.writerow(PROFILE_CSV_FIELDS)
+                    writer.writerows(self.rows)
+        except OSError as e:
+            log.warning("Could not save the profile: %s", e)
+
+profiler = FrameProfiler()
+
+# Position between the sprite's previous and current tick, alpha goes from 0 to 1
+def interpolated_position(sprite, alpha):
+    x, y = sprite.rect.topleft
+    previous_x, previous_y = sprite.previous
+    return round(previous_x + (x - previous_x) * alpha), round(previous_y + (y - previous_y) * alpha)
+
+# Draws a game to the screen, repainting the whole window or with dirty_rects only the areas that changed
+class Renderer:
+    def __init__(self, dirty_rects=DIRTY_RECTS):
+        self.dirty_rects = dirty_rects
+        self.drawn = [] # Sprite and HUD areas of the last frame, erased before the next one
+        self.full_redraw = True # First frame always paints the whole window
+
+    # alpha is how far the game is from its previous tick to the current one
+    def draw(self, game, alpha=1.0):
+        if self.dirty_rects and not self.full_redraw:
+            # Restore the background under last frame's sprites and HUD, then draw and update only those areas
+            for area in self.drawn:
+                screen.blit(assets.images["background"], area, area)
+            erased = self.drawn
+            with profiler.span("draw"):
+                self.drawn = self.draw_frame(game, alpha)
+            with profiler.span("present"):
+                pygame.display.update(erased + self.drawn)
+        else:
+            with profiler.span("draw"):
+                screen.blit(assets.images["background"], (0, 0))
+                self.drawn = self.draw_frame(game, alpha)
+            with profiler.span("present"):
+                pygame.display.flip()
+            self.full_redraw = False
+
+    def draw_frame(self, game, alpha):
+        areas = screen.blits(game.blit_sequence(alpha))
+        areas += draw_hud(game.score, game.player, game.level, game.show_level_message)
+        if profiler.visible:
+            areas.append(profiler.draw_overlay(game))
+        return areas
+
+# Input bits from the keyboard, events are this frame's pygame events
+def read_inputs(events):
+    keys = pygame.key.get_pressed()
+    inputs = 0
+    if keys[pygame.K_LEFT]:
+        inputs |= INPUT_LEFT
+    if keys[pygame.K_RIGHT]:
+        inputs |= INPUT_RIGHT
+    if keys[pygame.K_UP]:
+        inputs |= INPUT_JUMP
+    for event in events:
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+            inputs |= INPUT_SHOOT
+    return inputs
+
+def save_recording(path, seed, inputs):
+    with open(path, "w") as file:
+        json.dump({"seed": seed, "inputs": inputs}, file)
+
+def load_recording(path):
+    with open(path) as file:
+        recording = json.load(file)
+    return recording["seed"], recording["inputs"]
 
-        if show_level_message and pygame.time.get_ticks() - level_transition_timer > 2000:
-            show_level_message = False
-
-        if not show_level_message and level < 3 and score >= level_score_thresholds[level]:
-            level += 1
-            show_level_message = True
-            level_transition_timer = pygame.time.get_ticks()
-
-            if level == 2:
-                enemy_spawn_delay = 800
-            elif level == 3:
-                enemy_spawn_delay = 1500
-            pygame.time.set_timer(enemy_spawn_event, enemy_spawn_delay)
-
-        if level == 3 and score >= level_score_thresholds[3] and not boss_spawned:
-            boss = BossEnemy()
-            all_sprites.add(boss)
-            boss_spawned = True
-            pygame.time.set_timer(enemy_spawn_event, 0)
-
-        screen.blit(background_img, (0, 0))
-        all_sprites.draw(screen)
-        draw_text(f"Score: {score}", 22, BLACK, 10, 10)
-        draw_text(f"Health: {player.health}", 22, GREEN, 10, 40)
-        draw_text(f"Lives: {player.lives}", 22, BLUE, 10, 70)
-        draw_text(f"Level: {level}", 22, BLACK, WIDTH - 120, 10)
-
-        if show_level_message:
-            draw_text(f"Level {level}", 48, BLACK, WIDTH // 2 - 60, HEIGHT // 2 - 40)
-        draw_text("Use arrow keys to move and jump", 20, WHITE, WIDTH // 2 - 140, HEIGHT - 60)
-        draw_text("Press SPACE to shoot", 20, WHITE, WIDTH // 2 - 100, HEIGHT - 30)
+# Play one game in the window, from the keyboard or from a recording (seed, inputs)
+# record is a file the seed and inputs are saved to when the game ends
+# The game steps at TICK_RATE whatever the frame rate, frames show sprites interpolated between ticks
+# Returns "win" or "lose", or None when the window was closed or the recording ran out
+def main_game(seed=None, replay=None, record=None):
+    if replay:
+        seed, replay_inputs = replay
+        replay_inputs = iter(replay_inputs)
+    elif seed is None:
+        seed = random.randrange(2 ** 32)
+    game = new_game(seed, profiler.trace)
+    renderer = Renderer()
+    recorded = []
+    accumulator = 0.0 # Real time not yet simulated
+    last_time = time.perf_counter()
+    shoot_queued = False # SPACE pressed in a frame where no tick ran yet
+    result = None
+    playing = True
+
+    while playing:
+        with profiler.span("wait"):
+            clock.tick(frame_rate)
+        now = time.perf_counter()
+        accumulator = min(accumulator + now - last_time, MAX_TICKS_PER_FRAME * TICK_SECONDS)
+        last_time = now
+        with profiler.span("input"):
+            events = pygame.event.get()
+            if any(event.type == pygame.QUIT for event in events):
+                break
+            if any(event.type == pygame.KEYDOWN and event.key == pygame.K_F3 for event in events):
+                profiler.toggle()
+            held = read_inputs(events)
+            shoot_queued = shoot_queued or held & INPUT_SHOOT
+
+        ticks = 0
+        with profiler.span("simulate"):
+            while accumulator >= TICK_SECONDS:
+                accumulator -= TICK_SECONDS
+                if replay:
+                    inputs = next(replay_inputs, None)
+                    if inputs is None:
+                        playing = False
+                        break
+                else:
+                    inputs = held & ~INPUT_SHOOT
+                    if shoot_queued:
+                        inputs |= INPUT_SHOOT # One bullet per press, on the first tick after it
+                        shoot_queued = False
+
+                recorded.append(inputs)
+                result = game.step(inputs)
+                ticks += 1
+                if inputs & INPUT_SHOOT:
+                    audio.play("shoot")
+                if result:
+                    playing = False
+                    break
+        if playing:
+            renderer.draw(game, accumulator / TICK_SECONDS)
+            profiler.end_frame(game, ticks)
+
+    if record:
+        save_recording(record, seed, recorded)
+    return result
+
+# Draw an idle screen, then sleep in pygame.event.wait() until a key is pressed, drawing again only
+# when the window has to be repainted. Returns the key, or None when the window is closed
+def wait_for_key(draw):
+    draw()
+    while True:
+        event = pygame.event.wait()
+        if event.type == pygame.QUIT:
+            return None
+        if event.type == pygame.KEYDOWN:
+            return event.key
+        if event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+            draw()
+
+def draw_centered(text, size, color, y):
+    text_surface = render_text(text, size, color)
+    screen.blit(text_surface, text_surface.get_rect(center=(WIDTH // 2, y)))
+
+LOADING_FRAME_MS = 50 # Loading screen redraw interval
+
+# Scenes are the screens of the game, run() shows one until it returns the next scene, None quits.
+# Level transitions stay inside PlayScene because the game keeps running under the "Level" message
+class LoadingScene:
+    def __init__(self, options):
+        self.options = options
+
+    def draw(self):
+        screen.fill(BLACK)
+        bar = pygame.Rect(0, 0, WIDTH // 2, 16)
+        bar.center = (WIDTH // 2, HEIGHT // 2)
+        pygame.draw.rect(screen, WHITE, bar, 2)
+        progress = bar.inflate(-6, -6)
+        progress.width = progress.width * assets.loaded // assets.total
+        pygame.draw.rect(screen, WHITE, progress)
         pygame.display.flip()
 
-if __name__ == "__main__":
+    # Show progress while the assets load on a background thread
+    def run(self):
+        loader = ThreadPoolExecutor(max_workers=1)
+        loading = loader.submit(assets.load)
+        self.draw()
+        first_frame = time.perf_counter()
+        while not wait([loading], timeout=LOADING_FRAME_MS / 1000).done:
+            if any(event.type == pygame.QUIT for event in pygame.event.get()):
+                loader.shutdown(wait=False)
+                return None
+            self.draw()
+        loader.shutdown()
+        loading.result() # Raises here if loading failed
+        assets.finish()
+        start_music()
+        log.info("First frame after %.0f ms, assets ready after %.0f ms (%d of %d images from the disk cache)",
+                 (first_frame - STARTED) * 1000, (time.perf_counter() - STARTED) * 1000,
+                 assets.cached, len(IMAGE_ASSETS))
+        return TitleScene(self.options)
+
+class TitleScene:
+    def __init__(self, options):
+        self.options = options # (seed, replay, record) for the games started from here
+
+    def draw(self):
+        screen.blit(assets.images["background"], (0, 0))
+        draw_centered("The Mario of Darwin", 48, BLACK, HEIGHT // 2 - 40)
+        draw_centered("Press any key to start or Q to Quit", 30, WHITE, HEIGHT // 2 + 20)
+        pygame.display.flip()
+
+    def run(self):
+        key = wait_for_key(self.draw)
+        if key is None or key == pygame.K_q:
+            return None
+        return PlayScene(self.options)
+
+class PlayScene:
+    def __init__(self, options):
+        self.options = options
+
+    def run(self):
+        result = main_game(*self.options)
+        if result is None:
+            return None
+        return GameOverScene(result == "win", self.options)
+
+class GameOverScene:
+    def __init__(self, win, options):
+        self.win = win
+        self.options = options
+
+    def draw(self):
+        screen.fill(BLACK)
+        if self.win:
+            draw_centered("Congratulations! You defeated the Boss!", 36, GREEN, HEIGHT // 2 - 40)
+        else:
+            draw_centered("Game Over!", 48, RED, HEIGHT // 2 - 40)
+        draw_centered("Press R to Restart or Q to Quit", 30, WHITE, HEIGHT // 2 + 20)
+        pygame.display.flip()
+
+    def run(self):
+        while True:
+            key = wait_for_key(self.draw)
+            if key is None or key == pygame.K_q:
+                return None
+            if key == pygame.K_r:
+                return PlayScene(self.options)
+
+def run_scenes(scene):
+    while scene is not None:
+        scene = scene.run()
+    profiler.save()
+    pygame.quit()
+
+# Scripted player for the benchmark, keeps firing and jumps now and then
+def scripted_input(tick):
+    inputs = INPUT_SHOOT if tick % 8 == 0 else 0
+    if tick % 240 == 0:
+        inputs |= INPUT_JUMP
+    return inputs
+
+# Run a game as fast as possible without drawing, returns (result, inputs used, seconds, final game)
+def simulate(seed, inputs=None, make_game=new_game):
+    game = make_game(seed)
+    used = []
+    result = None
+    started = time.perf_counter()
+    while result is None:
+        if inputs is None:
+            tick_inputs = scripted_input(game.tick + 1)
+        elif game.tick < len(inputs):
+            tick_inputs = inputs[game.tick]
+        else:
+            break
+        used.append(tick_inputs)
+        result = game.step(tick_inputs)
+    return result, used, time.perf_counter() - started, game
+
+# Play the scripted game (or a recording) headless at full speed, replay it and check both end the same
+def benchmark(recording=None):
+    if recording:
+        seed, inputs = recording
+    else:
+        seed, inputs = BENCHMARK_SEED, None
+    result, inputs, seconds, game = simulate(seed, inputs)
+    replay_result, _, replay_seconds, replay = simulate(seed, inputs)
+    print(f"{game.tick} ticks to {result or 'end of recording'} at level {game.level}, score {game.score}")
+    print(f"run:    {game.tick / seconds:,.0f} ticks/s ({seconds:.3f} s)")
+    print(f"replay: {replay.tick / replay_seconds:,.0f} ticks/s ({replay_seconds:.3f} s)")
+    if replay_result != result or replay.snapshot() != game.snapshot():
+        print("replay diverged from the run")
+        return False
+    print("replay matches the run")
+    if np is not None:
+        # The other entity store has to play the same inputs out the same way
+        other = Game if ENTITY_ARRAYS else ArrayGame
+        other_result, _, other_seconds, other_game = simulate(seed, inputs, other)
+        print(f"{other.__name__}: {other_game.tick / other_seconds:,.0f} ticks/s ({other_seconds:.3f} s)")
+        if other_result != result or other_game.snapshot() != game.snapshot():
+            print(f"{other.__name__} diverged from {type(game).__name__}")
+            return False
+        print("sprite and array entity stores agree")
+    return True
+
+# Time entity updates, collisions and drawing with many bullets alive, for each entity store
+def stress_benchmark(bullets):
+    engines = [Game] if np is None else [Game, ArrayGame]
+    for engine in engines:
+        game = engine(BENCHMARK_SEED)
+        rng = random.Random(BENCHMARK_SEED)
+        update_seconds = draw_seconds = 0.0
+        for _ in range(STRESS_TICKS):
+            while len(game.projectiles) < bullets:
+                game.fire(rng.randrange(WIDTH), rng.randrange(GROUND_LEVEL - 60, GROUND_LEVEL))
+            while len(game.enemies) < STRESS_ENEMIES:
+                game.spawn_enemy()
+            started = time.perf_counter()
+            game.remember_positions()
+            game.move_entities()
+            game.resolve_collisions()
+            drawn = time.perf_counter()
+            screen.blits(game.blit_sequence(0.5), False)
+            finished = time.perf_counter()
+            update_seconds += drawn - started
+            draw_seconds += finished - drawn
+        print(f"{engine.__name__} with {bullets:,} bullets: update {update_seconds / STRESS_TICKS * 1000:.2f} ms, "
+              f"draw {draw_seconds / STRESS_TICKS * 1000:.2f} ms per tick")
+
+# Place the bullets and enemies of one --collision-benchmark frame, scattered over the screen or with the
+# bullets in a row at the height of the enemies, like rapid fire
+def collision_frame(game, bullets, enemies, rng, row):
+    for sprite in game.projectiles.sprites() + game.enemies.sprites():
+        sprite.kill()
+    for _ in range(bullets):
+        game.fire(rng.randrange(WIDTH), GROUND_LEVEL - 25 if row else rng.randrange(HEIGHT))
+    for _ in range(enemies):
+        enemy = Enemy.spawn(game.level, game.rng)
+        enemy.rect.x = rng.randrange(WIDTH)
+        enemy.health = bullets * Projectile.DAMAGE # Alive all frame, every bullet has the same enemies to test
+        if not row:
+            enemy.rect.y = rng.randrange(HEIGHT - enemy.rect.height)
+        game.add_sprite(enemy, game.enemies)
+
+# Time the collision pass with the grid broadphase against the brute force one it replaced, for a few
+# numbers of bullets and enemies, then check both play the scripted game out the same way
+def collision_benchmark():
+    for layout, row in (("scattered", False), ("rapid-fire row", True)):
+        for bullets, enemies in COLLISION_SCENARIOS:
+            timings = []
+            for engine in (BruteForceGame, Game):
+                game = engine(BENCHMARK_SEED)
+                rng = random.Random(BENCHMARK_SEED)
+                seconds = 0.0
+                for _ in range(COLLISION_FRAMES):
+                    collision_frame(game, bullets, enemies, rng, row)
+                    started = time.perf_counter()
+                    game.resolve_collisions()
+                    seconds += time.perf_counter() - started
+                timings.append(seconds / COLLISION_FRAMES * 1e6)
+            print(f"{layout}, {bullets} bullets and {enemies} enemies: brute force {timings[0]:,.0f} us, "
+                  f"grid {timings[1]:,.0f} us per frame")
+    result, inputs, _, game = simulate(BENCHMARK_SEED)
+    other_result, _, _, other = simulate(BENCHMARK_SEED, inputs, BruteForceGame)
+    if other_result != result or other.snapshot() != game.snapshot():
+        print("brute force and grid collisions diverged")
+        return False
+    print("brute force and grid collisions agree on the scripted game")
+    return True
+
+# CPU time and screen pixels presented per frame of the scripted game, with full redraws and with dirty rects
+def render_benchmark():
+    for name, dirty_rects in (("full redraw", False), ("dirty rects", True)):
+        game, renderer = Game(BENCHMARK_SEED), Renderer(dirty_rects)
+        cpu = 0.0
+        pixels = 0
+        for _ in range(RENDER_BENCHMARK_FRAMES):
+            if game.step(scripted_input(game.tick + 1)):
+                game = Game(game.seed + 1) # Keep drawing for the whole run
+            erased = renderer.drawn if dirty_rects and not renderer.full_redraw else None
+            started = time.process_time()
+            renderer.draw(game)
+            cpu += time.process_time() - started
+            if erased is None:
+                pixels += WIDTH * HEIGHT
+            else:
+                pixels += sum(area.width * area.height for area in erased + renderer.drawn)
+        print(f"{name}: {cpu / RENDER_BENCHMARK_FRAMES * 1000:.3f} ms CPU, "
+              f"{pixels // RENDER_BENCHMARK_FRAMES:,} pixels presented per frame")
+
+# Wait for a key polling the event queue, how the game over screen waited before the scenes
+def busy_wait_for_key(draw):
+    draw()
     while True:
-        main_game()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return None
+            if event.type == pygame.KEYDOWN:
+                return event.key
+
+# CPU use of each screen left alone for IDLE_BENCHMARK_SECONDS, Q is pressed at the end to leave it
+# Playing replays the scripted inputs in real time
+def idle_benchmark():
+    options = (BENCHMARK_SEED, None, None)
+    game_over = GameOverScene(False, options)
+    inputs = [scripted_input(tick + 1) for tick in range(IDLE_BENCHMARK_SECONDS * TICK_RATE)]
+    screens = [
+        ("game over, polling as before", lambda: busy_wait_for_key(game_over.draw)),
+        ("game over", game_over.run),
+        ("title", TitleScene(options).run),
+        ("playing", lambda: main_game(replay=(BENCHMARK_SEED, inputs))),
+    ]
+    for name, run in screens:
+        pygame.time.set_timer(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_q), IDLE_BENCHMARK_SECONDS * 1000, 1)
+        cpu, started = time.process_time(), time.perf_counter()
+        run()
+        seconds = time.perf_counter() - started
+        print(f"{name}: {(time.process_time() - cpu) / seconds * 100:.1f}% CPU over {seconds:.1f} s")
+        pygame.event.clear()
+
+# The HUD as it was drawn before the text cache, a new font and a new surface for every text
+def draw_hud_uncached(score, player, level, show_level_message):
+    def draw_text(text, size, color, x, y):
+        font = pygame.font.Font(font_path(), size)
+        screen.blit(font.render(text, True, color), (x, y))
+    draw_text(f"Score: {score}", 22, BLACK, 10, 10)
+    draw_text(f"Health: {player.health}", 22, GREEN, 10, 40)
+    draw_text(f"Lives: {player.lives}", 22, BLUE, 10, 70)
+    draw_text(f"Level: {level}", 22, BLACK, WIDTH - 120, 10)
+    if show_level_message:
+        draw_text(f"Level {level}", 48, BLACK, WIDTH // 2 - 60, HEIGHT // 2 - 40)
+    draw_text("Use arrow keys to move and jump", 20, WHITE, WIDTH // 2 - 140, HEIGHT - 60)
+    draw_text("Press SPACE to shoot", 20, WHITE, WIDTH // 2 - 100, HEIGHT - 30)
+
+# Time a HUD draw per frame without and with the text cache, with the score and health changing
+def hud_benchmark():
+    player = Player()
+    for name, draw in (("before (no text cache)", draw_hud_uncached), ("after (text cache)", draw_hud)):
+        started = time.perf_counter()
+        for frame in range(HUD_BENCHMARK_FRAMES):
+            player.health = 100 - frame % 100
+            draw(frame, player, 1, False)
+        seconds = time.perf_counter() - started
+        print(f"{name}: {seconds / HUD_BENCHMARK_FRAMES * 1e6:,.0f} us per frame")
+
+# Play and draw frames back to back with constant firing, with and without the sprite pools,
+# and report sprites constructed, gen0 collections and the spread of frame times
+def soak_test(frames):
+    for name, pool_limit in (("pooling off", 0), ("pooling on", POOL_LIMIT)):
+        constructed, collections, frame_ms = soak_run(frames, pool_limit)
+        frame_ms.sort()
+        print(f"{name}: {constructed:,} sprites constructed, {collections} gen0 collections, "
+              f"frame {statistics.mean(frame_ms):.3f} ms mean, {statistics.pstdev(frame_ms):.3f} ms stdev, "
+              f"{frame_ms[int(len(frame_ms) * 0.99)]:.3f} ms p99 over {frames:,} frames")
+
+# One soak with at most pool_limit sprites kept per pool, returns (sprites constructed, gen0 collections,
+# frame times in ms)
+def soak_run(frames, pool_limit):
+    pooled_classes = (Projectile, Enemy, Collectible)
+    for pooled in pooled_classes:
+        pooled.pool.clear()
+    PooledSprite.pool_limit = pool_limit
+    try:
+        game, renderer = Game(BENCHMARK_SEED), Renderer()
+        PooledSprite.constructed = 0
+        collections = gc.get_stats()[0]["collections"]
+        frame_ms = []
+        for _ in range(frames):
+            started = time.perf_counter()
+            inputs = INPUT_SHOOT | (INPUT_JUMP if game.tick % SOAK_JUMP_TICKS == 0 else 0)
+            if game.step(inputs):
+                game = Game(game.seed + 1) # Keep playing for the whole soak
+            renderer.draw(game)
+            frame_ms.append((time.perf_counter() - started) * 1000)
+        return PooledSprite.constructed, gc.get_stats()[0]["collections"] - collections, frame_ms
+    finally:
+        PooledSprite.pool_limit = POOL_LIMIT
+
+AUDIO_BENCHMARK_BUFFERS = (4096, 1024, AUDIO_BUFFER, 256) # 4096 samples was the pygame 1 default
+AUDIO_BENCHMARK_SHOTS = 10 # Shots timed for each buffer size
+AUDIO_CPU_SECONDS = 2.0 # Length of each mixer CPU measurement
+RAPID_FIRE_SHOTS = 40
+RAPID_FIRE_INTERVAL = 0.05 # Seconds between shots, faster than the sound is long
+
+# Time from audio.play() until the sound comes out of the mixer, and the CPU the mixer thread uses,
+# for a few buffer sizes. SDL's disk driver writes the mixed samples to a file at the pace of a sound
+# card, a sample counts as played when the buffer holding it has been written
+def audio_benchmark():
+    output = os.path.join(tempfile.gettempdir(), f"mario_audio_{os.getpid()}.raw")
+    os.environ["SDL_DISKAUDIOFILE"] = output
+    bytes_per_second = AUDIO_FREQUENCY * 4 # 16 bit stereo
+    try:
+        for buffer in AUDIO_BENCHMARK_BUFFERS:
+            audio.start(buffer)
+            started = time.perf_counter()
+            assets.load_sounds()
+            load_seconds = time.perf_counter() - started
+            shot = assets.sounds["shoot"]
+            volume = SOUND_ASSETS["shoot"][1]
+            raw = array.array("h", shot.get_raw())
+            lead = next(i for i, sample in enumerate(raw) if abs(sample) * volume >= 1) * 2 # Silence the file starts with
+            gap = shot.get_length() + 0.1 # Silence between shots, to find where each one starts
+
+            time.sleep(gap)
+            shots = []
+            for _ in range(AUDIO_BENCHMARK_SHOTS):
+                written = os.path.getsize(output)
+                triggered = time.perf_counter()
+                audio.play("shoot")
+                writes = [] # (time, file size) after each buffer the driver writes
+                while time.perf_counter() < triggered + gap:
+                    size = os.path.getsize(output)
+                    if size != (writes[-1][1] if writes else written):
+                        writes.append((time.perf_counter(), size))
+                    time.sleep(0.0005)
+                shots.append((triggered, written, writes))
+
+            cpu = []
+            for busy in (False, True):
+                if busy:
+                    start_music()
+                    for channel, _ in audio.voices["weapon"]:
+                        channel.play(shot, loops=-1)
+                started, cpu_started = time.perf_counter(), time.process_time()
+                time.sleep(AUDIO_CPU_SECONDS)
+                cpu.append((time.process_time() - cpu_started) / (time.perf_counter() - started))
+            audio.stop()
+
+            with open(output, "rb") as file:
+                samples = array.array("h", file.read())
+            latencies = []
+            for triggered, written, writes in shots:
+                first = next(i for i in range(written // 2, len(samples)) if samples[i]) * 2 - lead
+                previous = written
+                for heard, size in writes:
+                    if size > first:
+                        break
+                    previous = size
+                latencies.append(heard - triggered + (first - previous) / bytes_per_second)
+            latencies.sort()
+            print(f"buffer {buffer:4} ({buffer / AUDIO_FREQUENCY * 1000:5.1f} ms): "
+                  f"trigger to output {latencies[len(latencies) // 2] * 1000:5.1f} ms median, "
+                  f"{latencies[-1] * 1000:5.1f} ms worst, mixer CPU {cpu[0] * 100:.1f}% idle, "
+                  f"{cpu[1] * 100:.1f}% with music and {SOUND_CHANNELS['weapon']} shots, "
+                  f"sounds loaded in {load_seconds * 1000:.1f} ms")
+
+        # Rapid fire, Sound.play() on the default channels against the reserved weapon channels
+        pygame.mixer.init()
+        assets.load_sounds()
+        dropped = sum(assets.sounds["shoot"].play() is None for _ in rapid_fire())
+        pygame.mixer.quit()
+        audio.start()
+        assets.load_sounds()
+        audio.steals = 0
+        for _ in rapid_fire():
+            audio.play("shoot")
+        audio.stop()
+        print(f"rapid fire, {RAPID_FIRE_SHOTS} shots {RAPID_FIRE_INTERVAL * 1000:.0f} ms apart: {dropped} dropped on "
+              f"the default channels, none dropped and {audio.steals} older shots cut off on the weapon channels")
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+
+def rapid_fire():
+    for _ in range(RAPID_FIRE_SHOTS):
+        yield
+        time.sleep(RAPID_FIRE_INTERVAL)
+
+OBSERVED_ENEMIES = 3 # Enemies in a state observation, oldest first
+STATE_SIZE = 8 + 2 * OBSERVED_ENEMIES + 3 # Player, level and boss, enemies, first collectible
+FRAME_SIZE = (WIDTH // 4, HEIGHT // 4) # Frame observations are the screen scaled down to this
+MAX_EPISODE_TICKS = 5 * 60 * TICK_RATE # Games are cut off after five minutes of game time
+REWARD_WIN = 10 # On top of one point per enemy killed
+REWARD_LOSE = -10
+VECTOR_BENCHMARK_STEPS = 500 # Steps of every game timed by --vector-benchmark
+
+# Shape and dtype of one observation
+def observation_spec(frames):
+    if frames:
+        return (FRAME_SIZE[1], FRAME_SIZE[0], 3), np.uint8
+    return (STATE_SIZE,), np.float32
+
+# Gym style environment for agents, reset() starts a game and step(action) advances it one tick.
+# Actions are INPUT_* bits. Observations are a state vector, or with frames the screen scaled down
+# to FRAME_SIZE as RGB. Needs numpy, open_window() and the assets loaded
+class GameEnv:
+    def __init__(self, frames=False):
+        self.frames = frames
+        self.seeds = random.Random() # Seeds of the games started by reset()
+        self.game = None
+        self.renderer = Renderer()
+
+    # seed makes this and the following games repeatable, out is an array to write the observation to
+    def reset(self, seed=None, out=None):
+        if seed is not None:
+            self.seeds.seed(seed)
+        self.game = new_game(self.seeds.randrange(2 ** 32))
+        return self.observe(out)
+
+    # Returns (observation, reward, done, info), info["result"] is "win", "lose", or None when cut off
+    def step(self, action, out=None):
+        game = self.game
+        score = game.score
+        result = game.step(action)
+        reward = game.score - score
+        if result == "win":
+            reward += REWARD_WIN
+        elif result == "lose":
+            reward += REWARD_LOSE
+        done = result is not None or game.tick >= MAX_EPISODE_TICKS
+        return self.observe(out), reward, done, {"result": result, "score": game.score, "tick": game.tick}
+
+    def observe(self, out=None):
+        if out is None:
+            shape, dtype = observation_spec(self.frames)
+            out = np.empty(shape, dtype)
+        if self.frames:
+            screen.blit(assets.images["background"], (0, 0))
+            self.renderer.draw_frame(self.game, 1.0)
+            frame = pygame.image.tobytes(pygame.transform.scale(screen, FRAME_SIZE), "RGB")
+            out[...] = np.frombuffer(frame, np.uint8).reshape(out.shape)
+            return out
+
+        game = self.game
+        player = game.player
+        boss = game.boss if game.boss_alive() else None
+        out[:8] = (player.rect.x, player.rect.y, player.vel_y, player.health, player.lives, game.level,
+                   boss.rect.x if boss else -1, boss.health if boss else 0)
+        out[8:] = -1 # Missing enemies and collectible
+        for i, position in enumerate(game.enemy_positions(OBSERVED_ENEMIES)):
+            out[8 + 2 * i:10 + 2 * i] = position
+        collectible = game.first_collectible()
+        if collectible:
+            out[-3:] = collectible
+        return out
+
+# Runs a slice of a VectorEnv's games in a worker process, observations go straight to shared memory
+def env_worker(connection, memory_name, count, first, end, frames):
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    open_window()
+    load_assets_now()
+    memory = shared_memory.SharedMemory(name=memory_name)
+    shape, dtype = observation_spec(frames)
+    observations = np.ndarray((count,) + shape, dtype, buffer=memory.buf)
+    envs = [GameEnv(frames) for _ in range(first, end)]
+    while True:
+        command, data = connection.recv()
+        if command == "reset":
+            for i, env in enumerate(envs):
+                env.reset(None if data is None else data + i, observations[first + i])
+            connection.send(None)
+        elif command == "step":
+            rewards, dones, infos = [], [], []
+            for i, (env, action) in enumerate(zip(envs, data)):
+                _, reward, done, info = env.step(action, observations[first + i])
+                if done:
+                    env.reset(out=observations[first + i])
+                rewards.append(reward)
+                dones.append(done)
+                infos.append(info)
+            connection.send((rewards, dones, infos))
+        else:
+            break
+    del observations
+    memory.close()
+
+# Many GameEnvs stepped together by a pool of worker processes, each running a slice of the games.
+# Observations of all games are one shared memory array, so only actions, rewards and infos go
+# through the pipes. Finished games start again straight away, like gym vector environments
+class VectorEnv:
+    def __init__(self, count, workers=None, frames=False):
+        workers = min(count, workers or os.cpu_count() or 1)
+        shape, dtype = observation_spec(frames)
+        self.count = count
+        self.memory = shared_memory.SharedMemory(create=True, size=count * int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.observations = np.ndarray((count,) + shape, dtype, buffer=self.memory.buf)
+        self.slices = [(int(part[0]), int(part[-1]) + 1) for part in np.array_split(np.arange(count), workers)]
+        self.connections = []
+        self.processes = []
+        context = multiprocessing.get_context("spawn") # Workers start clean instead of copying this process's SDL state
+        for first, end in self.slices:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=env_worker, daemon=True,
+                                      args=(worker_connection, self.memory.name, count, first, end, frames))
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    # Game i is seeded with seed + i, returns the observations array
+    def reset(self, seed=None):
+        for connection, (first, _) in zip(self.connections, self.slices):
+            connection.send(("reset", None if seed is None else seed + first))
+        for connection in self.connections:
+            connection.recv()
+        return self.observations
+
+    # actions holds one INPUT_* bit set per game, returns (observations, rewards, dones, infos).
+    # observations is the shared array itself and is overwritten by the next step
+    def step(self, actions):
+        for connection, (first, end) in zip(self.connections, self.slices):
+            connection.send(("step", [int(action) for action in actions[first:end]]))
+        rewards = np.empty(self.count, np.float32)
+        dones = np.empty(self.count, bool)
+        infos = []
+        for connection, (first, end) in zip(self.connections, self.slices):
+            rewards[first:end], dones[first:end], slice_infos = connection.recv()
+            infos += slice_infos
+        return self.observations, rewards, dones, infos
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+        for process in self.processes:
+            process.join()
+        del self.observations
+        self.memory.close()
+        self.memory.unlink()
+
+# Aggregate steps per second of count games with random actions, in this process and with 1 to all cores
+def vector_benchmark(count, frames=False):
+    actions = np.array([0, INPUT_SHOOT, INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP, INPUT_RIGHT | INPUT_SHOOT])
+    rng = np.random.default_rng(BENCHMARK_SEED)
+    env = GameEnv(frames)
+    env.reset(BENCHMARK_SEED)
+    started = time.perf_counter()
+    for action in rng.choice(actions, VECTOR_BENCHMARK_STEPS).tolist():
+        if env.step(action)[2]:
+            env.reset()
+    seconds = time.perf_counter() - started
+    print(f"1 game in this process: {VECTOR_BENCHMARK_STEPS / seconds:,.0f} steps/s")
+
+    for workers in range(1, min(count, os.cpu_count() or 1) + 1):
+        vector = VectorEnv(count, workers, frames)
+        vector.reset(BENCHMARK_SEED)
+        started = time.perf_counter()
+        for _ in range(VECTOR_BENCHMARK_STEPS):
+            vector.step(rng.choice(actions, count))
+        seconds = time.perf_counter() - started
+        vector.close()
+        print(f"{count} games on {workers} worker(s): {count * VECTOR_BENCHMARK_STEPS / seconds:,.0f} steps/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="The Mario of Darwin")
+    parser.add_argument("--seed", type=int, help="seed for enemy and collectible spawns")
+    parser.add_argument("--record", metavar="FILE", help="save the seed and inputs of each game to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="play back a recorded game")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="run the scripted playthrough (or --replay) headless and report ticks per second")
+    parser.add_argument("--stress", type=int, metavar="BULLETS",
+                        help="time entity updates and drawing with this many bullets alive")
+    parser.add_argument("--vector-benchmark", type=int, metavar="GAMES",
+                        help="report agent environment steps per second for this many games on 1 to all cores")
+    parser.add_argument("--collision-benchmark", action="store_true",
+                        help="time the collision grid against the brute force collisions it replaced")
+    parser.add_argument("--render-benchmark", action="store_true",
+                        help="report CPU time and pixels presented per frame with full redraws and with dirty rects")
+    parser.add_argument("--idle-benchmark", action="store_true",
+                        help="report the CPU use of the title, game over and play screens")
+    parser.add_argument("--hud-benchmark", action="store_true",
+                        help="report the HUD drawing time per frame without and with the text cache")
+    parser.add_argument("--soak", type=int, metavar="FRAMES",
+                        help="play this many frames with constant firing and report allocations and frame-time jitter")
+    parser.add_argument("--audio-benchmark", action="store_true",
+                        help="report sound trigger to output latency and mixer CPU for a few buffer sizes")
+    parser.add_argument("--frames", action="store_true", help="use frame observations in --vector-benchmark")
+    parser.add_argument("--trace", metavar="FILE", help="save a Chrome trace (chrome://tracing) of the frames to FILE")
+    parser.add_argument("--frame-csv", metavar="FILE", help="save the phase timings of every frame to FILE")
+    parser.add_argument("--verbose", action="store_true", help="log startup times and other details")
+    args = parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    profiler.configure(args.trace, args.frame_csv)
+    replay = load_recording(args.replay) if args.replay else None
+    if (args.stress or args.benchmark or args.vector_benchmark or args.hud_benchmark or args.soak
+            or args.collision_benchmark or args.render_benchmark or args.idle_benchmark):
+        # Benchmarks run the game without a window or sound device
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+        open_window()
+        load_assets_now()
+    if args.collision_benchmark:
+        sys.exit(0 if collision_benchmark() else 1)
+    if args.render_benchmark:
+        render_benchmark()
+        sys.exit()
+    if args.idle_benchmark:
+        idle_benchmark()
+        sys.exit()
+    if args.hud_benchmark:
+        hud_benchmark()
+        sys.exit()
+    if args.soak:
+        soak_test(args.soak)
+        sys.exit()
+    if args.stress:
+        stress_benchmark(args.stress)
+        sys.exit()
+    if args.benchmark:
+        sys.exit(0 if benchmark(replay) else 1)
+    if args.vector_benchmark:
+        vector_benchmark(args.vector_benchmark, args.frames)
+        sys.exit()
+    if args.audio_benchmark:
+        # Mixed into a file at the pace of a sound card, so what comes out can be timed
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "disk"
+        audio_benchmark()
+        sys.exit()
+    open_window()
+    start_audio()
+    run_scenes(LoadingScene((args.seed, replay, args.record)))
@@ -1,31 +1,106 @@
 # Crop Your Image Application -> Upload, crop, rotate, flip and save pictures
 
+import time
+STARTED = time.perf_counter() # Start of the --startup-benchmark timings
+
+import copy
+import json
+import logging
+import os
+import sys
+import tempfile
 import tkinter as tk
-import ttkbootstrap as ttk # bootstrap for better UI display
-from ttkbootstrap.constants import *
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
 from tkinter import filedialog, messagebox
+
+# Plain Tk window put on screen before ttkbootstrap and PIL are imported, they take most of the startup
+# time. The app is built in this same window once they are loaded
+def show_first_window():
+    enable_high_dpi_awareness()
+    root = tk.Tk()
+    root.title("Crop Your Image")
+    root.geometry("1000x650")
+    root.configure(bg="#F0F2F5")
+    tk.Label(root, text="Loading...", font=("Helvetica", 18, "bold"), bg="#F0F2F5").pack(expand=True)
+    root.update()
+    return root
+
+# Sharp instead of scaled up on high DPI screens under Windows, as ttk.Window does, has to happen before
+# the Tk window exists
+def enable_high_dpi_awareness():
+    if sys.platform != "win32":
+        return
+    import ctypes
+    try:
+        ctypes.windll.shcore.SetProcessDpiAwareness(1)
+    except (AttributeError, OSError):
+        ctypes.windll.user32.SetProcessDPIAware() # Windows before 8.1
+
+if __name__ == "__main__":
+    app_root = show_first_window()
+    FIRST_PAINT = time.perf_counter() # First window on screen, for --startup-benchmark
+
+import ttkbootstrap as ttk # bootstrap for better UI display
+from ttkbootstrap.window import apply_all_bindings, apply_class_bindings
 from PIL import Image, ImageTk
+from perf_trace import PerfTrace
+from crop_engine import (
+    BENCHMARK_JPEG_SIZE, EditHistory, PictureEdits, PreviewCache, benchmark_path, build_picture_pyramid,
+    display_box_to_original, export_picture, open_picture_file, picture_thumbnail, preview_source, pyramid_preview,
+    write_test_jpeg
+)
+IMPORTED = time.perf_counter() # End of the imports, for --startup-benchmark
+
+RESIZE_DEBOUNCE_MS = 120 # Wait after the last window resize event before redrawing
+PHOTO_CACHE_SIZE = 8 # Number of resized background/preview pictures kept for reuse
+WORKER_POLL_MS = 15 # How often the Tk thread checks for finished image jobs
+SLIDER_RENDER_MS = 30 # Shortest time between two previews while the slider moves
+PERF_OVERLAY_MS = 500 # Refresh time of the performance overlay (F2)
+TRACE_ENV = "CROP_YOUR_IMAGE_TRACE" # Set to a file path to save a Chrome trace of the session on exit
+LOG_ENV = "CROP_YOUR_IMAGE_LOG" # Set to a logging level (debug, info) to print the app's log messages
+BACKGROUND_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "background.jpeg") # Optional
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                         "crop_your_image") # Preview cache and the list of recent pictures
+RECENT_PICTURES = 8 # Pictures shown in the recent strip
+THUMBNAIL_SIZE = 48 # Largest side of the recent strip thumbnails
+BENCHMARK_TICK_MS = 5 # The benchmarks measure how late the Tk main loop runs a timer set this often
+BENCHMARK_STEP_MS = 100 # Pause between two steps of a scripted benchmark session
+RESIZE_STORM_EVENTS = 100 # Window sizes set one after another by --resize-benchmark, like dragging a corner
+RESIZE_STORM_MS = 10 # Time between two of those sizes
+
+log = logging.getLogger(__name__)
 
 class CropYourImage:
-    def __init__(self, root):
+    def __init__(self, root, cache_dir=CACHE_DIR):
         self.root = root
+        self.cache_dir = cache_dir
         self.root.title("Crop Your Image")
         self.root.geometry("1000x650")
         self.root.configure(bg="#F0F2F5")
 
         # Initialization for the image and canvas objects
-        self.original_picture = None
+        self.original_size = None # Size of the uploaded picture in pixels
+        self.picture_path = None
+        self.picture_pyramid = [] # Reduced copies of the original picture, largest first
         self.background_orginal = None
         self.resized_picture = None #displays resized image 
-        self.cropped_pil_pic = None # PIL image of the cropped image
+        self.picture_edits = None # Crop, rotation, flip and resize of the original picture
+        self.history = EditHistory() # Undo and redo of picture_edits
         self.current_resized_cropped = None
         
-        # Object IDs for original picture, cropped rectangle and pictures
+        # Object IDs for background, original picture, cropped rectangle and pictures
+        # Items are created once and then updated in place
+        self.background_pic_id = None
         self.canvas_pic_id = None
         self.rectangle_pic_id = None
         self.cropped_pic_id = None
+        self.canvas_items_created = 0 # Canvas items created in the current interaction, items are never destroyed
+        self.canvas_items_report = None # Items created by the last interaction, shown by the overlay
 
         # Coordinates of cropped rectangle borders
+        self.cropping = False # True while the crop rectangle is being dragged
         self.crop_start_x = 0
         self.crop_start_y = 0
 
@@ -36,17 +111,48 @@ class CropYourImage:
         self.display_pic_width = 0
         self.display_pic_height = 0
 
+        # Window resize handling
+        self.resize_after_id = None # Pending redraw scheduled by the last resize event
+        self.canvas_size = None # Canvas size used for the last redraw
+        self.photo_cache = OrderedDict() # (source, size) -> (PIL picture, PhotoImage), least recent first
+
+        # Slow PIL work runs on one worker thread, so jobs run in the order they were submitted
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crop-your-image")
+        # Thumbnails have their own worker so they never wait behind a big picture
+        self.thumbnail_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crop-your-image-thumbnails")
+        self.jobs = {} # target -> (future, done, failed) of the newest job for that target
+        self.polling_jobs = False
+        self.slider_after_id = None # Pending preview render scheduled by the slider
+
+        # Timed spans of every processing stage, shown by the overlay and saved as a trace on exit
+        self.trace = PerfTrace()
+        self.trace_path = os.environ.get(TRACE_ENV)
+        self.perf_overlay_id = None
+        self.perf_overlay_after_id = None
+
+        # Previously opened pictures, their previews are kept on disk and shown before the full picture is ready
+        self.preview_cache = PreviewCache(cache_dir)
+        self.recent_paths = self.load_recent_paths() # Most recent first
+        self.recent_photos = {} # path -> thumbnail PhotoImage
+        self.recent_buttons = []
         
         self.reference_picture = [] # Keep references of pictures to remove garbage collection
         self.app_background() # Load background picture of the application
         self.app_gui() # Sets up GUI components for the app
+        self.update_recent_strip()
 
-    # Load background of the application
+    # Load background of the application on the worker thread, the window is drawn without it until then
     def app_background(self):
-        try:
-            self.background_orginal = Image.open("background.jpeg")
-        except Exception:
-            self.background_orginal = None
+        screen_size = (self.root.winfo_screenwidth(), self.root.winfo_screenheight())
+        self.run_job(
+            lambda: self.timed("background", load_background, screen_size),
+            self.show_background,
+            failed=lambda e: log.debug("No background picture: %s", e)
+        )
+
+    def show_background(self, picture):
+        self.background_orginal = picture
+        self.update_displayed_picture()
 
     # Create all GUI components 
     def app_gui(self):
@@ -122,6 +228,14 @@ class CropYourImage:
         flip_button = ttk.Button(control_frame, text="Flip H", bootstyle="info-outline", width=8, command=self.flip_picture)
         flip_button.pack(side=tk.LEFT, padx=5)
 
+        # Buttons to step back and forth through the edits
+        self.undo_button = ttk.Button(control_frame, text="↶ Undo", bootstyle="secondary-outline", width=7,
+                                      command=self.undo_edit, state=tk.DISABLED)
+        self.undo_button.pack(side=tk.LEFT, padx=5)
+        self.redo_button = ttk.Button(control_frame, text="↷ Redo", bootstyle="secondary-outline", width=7,
+                                      command=self.redo_edit, state=tk.DISABLED)
+        self.redo_button.pack(side=tk.LEFT, padx=5)
+
         # Show label for the Slider and display resized value
         self.resize_label_value = tk.StringVar(value="Resize Cropped Image:")
         resize_label = ttk.Label(control_frame, textvariable=self.resize_label_value, font=('Helvetica', 10))
@@ -143,123 +257,383 @@ class CropYourImage:
         )
         self.resize_slider.set(100)
         self.resize_slider.pack(side=tk.LEFT, padx=(5, 15), pady=10)
-        self.resize_slider.bind("<ButtonRelease-1>", self.slider_warning)
+        self.resize_slider.bind("<ButtonRelease-1>", self.slider_released)
+        # Only keys that move the slider, Tab or Ctrl+Z must not render the picture again
+        for key in ("Left", "Right", "Up", "Down", "Home", "End", "Prior", "Next"):
+            self.resize_slider.bind(f"<KeyRelease-{key}>", self.slider_released)
+
+        # Strip of recently opened pictures above the buttons, clicking one opens it again
+        recent_frame = tk.Frame(self.root, bg="#F0F2F5")
+        recent_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=15, pady=(10, 0))
+        tk.Label(recent_frame, text="Recent:", bg="#F0F2F5", font=('Helvetica', 10)).pack(side=tk.LEFT, padx=(0, 5))
+        # Buttons are created once and shown, hidden and updated as the list changes
+        # Blank picture until the thumbnail is ready, also makes the button size count in pixels
+        self.blank_thumbnail = tk.PhotoImage(width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE)
+        for _ in range(RECENT_PICTURES):
+            button = tk.Button(recent_frame, relief=tk.FLAT, bg="#F0F2F5", image=self.blank_thumbnail,
+                               width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE)
+            self.recent_buttons.append(button)
 
         # Bindings
-        self.root.bind("<Configure>", self.update_displayed_picture) # Bind window resize to update picture display
+        self.root.bind("<Configure>", self.schedule_redraw) # Bind window resize to update picture display
         self.canvas.bind("<ButtonPress-1>", self.start_crop) # Starts cropping while pressing mouse
         self.canvas.bind("<B1-Motion>", self.update_crop) # Updates cropped rectangle when dragging
         self.canvas.bind("<ButtonRelease-1>", self.end_crop) # Finalize crop while releasing mouse
+        self.root.bind("<F2>", self.toggle_perf_overlay) # Show or hide timings of the last operations
+        self.root.bind("<Control-z>", self.undo_edit)
+        self.root.bind("<Control-y>", self.redo_edit)
+        self.root.bind("<Control-Z>", self.redo_edit) # Ctrl+Shift+Z
+        self.root.protocol("WM_DELETE_WINDOW", self.close_app)
 
     # To upload the picture and display in the main screen
     def upload_picture(self):
-        path = filedialog.askopenfilename(filetypes=[("Image files", "*.png;*.jpg;*.jpeg")])
+        path = filedialog.askopenfilename(filetypes=[("Image files", "*.png;*.jpg;*.jpeg;*.tif;*.tiff;*.bmp;*.ppm")])
         if path:
-            self.original_picture = Image.open(path)
-            self.reset_after_new_upload()
+            self.open_picture_path(path)
+
+    # Show the cached preview of a picture opened before right away, the full picture loads on the worker thread
+    # Full resolution pixels are only decoded when a crop is made
+    def open_picture_path(self, path):
+        started = time.perf_counter()
+        cached = self.timed("preview cache", self.preview_cache.get, path)
+        if cached:
+            self.show_uploaded_picture(path, cached[0], [cached[1]])
+            log.debug("%s: cached preview shown after %.0f ms", path, (time.perf_counter() - started) * 1000)
+        self.run_job(
+            lambda: self.open_picture(path, store=not cached),
+            lambda result: self.show_full_picture(path, bool(cached), started, *result),
+            target="upload"
+        )
+        self.add_recent_path(path)
+
+    # Read the picture size and decode its reduced copies on the worker thread
+    def open_picture(self, path, store):
+        with self.trace.span("open"):
+            with open_picture_file(path) as picture:
+                size = picture.size
+        with self.trace.span("decode + pyramid"):
+            pyramid = build_picture_pyramid(path)
+        if store:
+            with self.trace.span("preview cache write"):
+                self.preview_cache.put(path, size, pyramid)
+        return size, pyramid
+
+    # Show a picture opened by the worker thread, or swap it in under its cached preview keeping the crop
+    def show_full_picture(self, path, preview_shown, started, size, pyramid):
+        if preview_shown and path == self.picture_path:
+            self.forget_cached_photos("picture")
+            self.history.forget_pictures()
+            self.picture_pyramid = pyramid
             self.update_displayed_picture()
+        else:
+            self.show_uploaded_picture(path, size, pyramid)
+        log.debug("%s: full picture shown after %.0f ms", path, (time.perf_counter() - started) * 1000)
+
+    def show_uploaded_picture(self, path, size, pyramid):
+        self.original_size = size
+        self.picture_path = path
+        self.forget_cached_photos("picture")
+        self.picture_pyramid = pyramid
+        self.reset_after_new_upload()
+        self.update_displayed_picture()
+
+    # Recent pictures saved by an earlier session, pictures deleted since then are left out
+    def load_recent_paths(self):
+        try:
+            with open(os.path.join(self.cache_dir, "recent.json")) as file:
+                paths = json.load(file)
+        except (OSError, ValueError):
+            return []
+        return [path for path in paths if isinstance(path, str) and os.path.isfile(path)][:RECENT_PICTURES]
+
+    def add_recent_path(self, path):
+        self.recent_paths = [path] + [recent for recent in self.recent_paths if recent != path][:RECENT_PICTURES - 1]
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(os.path.join(self.cache_dir, "recent.json"), "w") as file:
+                json.dump(self.recent_paths, file)
+        except OSError as e:
+            log.warning("Could not save the recent pictures: %s", e)
+        self.update_recent_strip()
+
+    # Show a button for every recent picture, thumbnails not made yet are decoded on the thumbnail worker
+    def update_recent_strip(self):
+        for path in list(self.recent_photos):
+            if path not in self.recent_paths:
+                del self.recent_photos[path]
+        for index, button in enumerate(self.recent_buttons):
+            if index >= len(self.recent_paths):
+                button.pack_forget()
+                continue
+            path = self.recent_paths[index]
+            button.config(image=self.recent_photos.get(path, self.blank_thumbnail), command=lambda path=path: self.open_picture_path(path))
+            button.pack(side=tk.LEFT, padx=2)
+            if path not in self.recent_photos and ("thumbnail", path) not in self.jobs: # Submitted once per path
+                self.run_job(
+                    lambda path=path: self.timed("thumbnail", picture_thumbnail, path, THUMBNAIL_SIZE, self.preview_cache),
+                    lambda thumbnail, path=path: self.show_recent_thumbnail(path, thumbnail),
+                    target=("thumbnail", path), failed=lambda e, path=path: log.warning("No thumbnail for %s: %s", path, e),
+                    worker=self.thumbnail_worker
+                )
+
+    def show_recent_thumbnail(self, path, thumbnail):
+        if path in self.recent_paths:
+            self.recent_photos[path] = ImageTk.PhotoImage(thumbnail)
+            self.update_recent_strip()
+
+    # Run slow PIL work off the Tk thread, done(result) is called back on the Tk thread
+    # A newer job for the same target supersedes the older one, jobs without target are never superseded
+    def run_job(self, work, done, target=None, failed=None, worker=None):
+        previous = self.jobs.get(target)
+        if previous:
+            previous[0].cancel() # Stale job is dropped if it has not started yet
+        self.jobs[target if target is not None else object()] = ((worker or self.worker).submit(work), done, failed)
+        if not self.polling_jobs:
+            self.polling_jobs = True
+            self.root.after(WORKER_POLL_MS, self.check_jobs)
+
+    # Forget the newest job of a target, its result is not shown
+    def drop_job(self, target):
+        job = self.jobs.pop(target, None)
+        if job:
+            job[0].cancel()
+
+    # Hand finished jobs back to their callbacks, PhotoImages are only created here on the Tk thread
+    # Polling goes on when a callback raises, so later jobs are still delivered
+    def check_jobs(self):
+        try:
+            for target, (future, done, failed) in list(self.jobs.items()):
+                if not future.done():
+                    continue
+                del self.jobs[target]
+                if future.cancelled():
+                    continue
+                error = future.exception()
+                if error is None:
+                    done(future.result())
+                elif failed:
+                    failed(error)
+                else:
+                    messagebox.showerror("Crop Your Image", f"Image processing failed:\n{error}")
+        finally:
+            if self.jobs:
+                self.root.after(WORKER_POLL_MS, self.check_jobs)
+            else:
+                self.polling_jobs = False
+
+    # Call function inside a timed span of the trace
+    def timed(self, name, function, *args):
+        with self.trace.span(name):
+            return function(*args)
+
+    # Show or hide the overlay with the timings of the last operations and the memory
+    def toggle_perf_overlay(self, event=None):
+        if self.perf_overlay_after_id:
+            self.root.after_cancel(self.perf_overlay_after_id)
+            self.perf_overlay_after_id = None
+            self.hide_canvas_item(self.perf_overlay_id)
+        else:
+            self.refresh_perf_overlay()
+
+    # Redraw the overlay text while it is shown
+    def refresh_perf_overlay(self):
+        lines = self.trace.summary() or ["No timings yet"]
+        if self.canvas_items_report:
+            lines.append(self.canvas_items_report)
+        lines.append(f"edit history: {len(self.history.steps)} steps, {self.history.memory() / 1e6:.1f} MB")
+        text = "\n".join(lines)
+        x = self.canvas.winfo_width() - 10
+        if self.perf_overlay_id is None:
+            self.canvas_items_created += 1
+            self.perf_overlay_id = self.canvas.create_text(
+                x, 10, anchor=tk.NE, justify=tk.RIGHT, font=("Courier", 9), fill="#202020", text=text
+            )
+        else:
+            self.canvas.coords(self.perf_overlay_id, x, 10)
+            self.canvas.itemconfig(self.perf_overlay_id, text=text, state=tk.NORMAL)
+        self.canvas.tag_raise(self.perf_overlay_id)
+        self.perf_overlay_after_id = self.root.after(PERF_OVERLAY_MS, self.refresh_perf_overlay)
+
+    # Save the session trace when asked for and close the app
+    def close_app(self):
+        self.worker.shutdown(wait=False, cancel_futures=True)
+        self.thumbnail_worker.shutdown(wait=False, cancel_futures=True)
+        if self.trace_path:
+            try:
+                self.trace.export(self.trace_path)
+            except OSError as e:
+                log.warning("Could not save trace to %s: %s", self.trace_path, e)
+        self.root.destroy()
+
+    # Coalesce bursts of resize events into one redraw after the user stops dragging
+    def schedule_redraw(self, event=None):
+        if self.resize_after_id:
+            self.root.after_cancel(self.resize_after_id)
+        self.resize_after_id = self.root.after(RESIZE_DEBOUNCE_MS, self.redraw_if_resized)
+
+    # Redraw only when the canvas size really changed (Configure also fires for moves and child widgets)
+    def redraw_if_resized(self):
+        self.resize_after_id = None
+        size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        if size != self.canvas_size:
+            self.update_displayed_picture()
+
+    # Return a cached (PIL picture, PhotoImage) pair for the source and size, creating it if needed
+    def cached_photo(self, source, size, make_picture):
+        key = (source, size)
+        if key in self.photo_cache:
+            self.photo_cache.move_to_end(key)
+            return self.photo_cache[key]
+        picture = make_picture()
+        with self.trace.span("PhotoImage"):
+            self.photo_cache[key] = (picture, ImageTk.PhotoImage(picture))
+        if len(self.photo_cache) > PHOTO_CACHE_SIZE:
+            self.photo_cache.popitem(last=False)
+        return self.photo_cache[key]
+
+    # Remove cached pictures of a source which is no longer displayed
+    def forget_cached_photos(self, kind):
+        for key in [key for key in self.photo_cache if key[0][0] == kind]:
+            del self.photo_cache[key]
 
     # Reset screen when a new picture is uploaded
     def reset_after_new_upload(self):
         """Reset state variables after loading a new image."""
-        self.cropped_pil_pic = None
+        self.picture_edits = None
+        self.history = EditHistory()
+        self.update_history_buttons()
         self.current_resized_cropped = None
         self.resize_slider.set(100)
         self.resize_label_value.set("Resize Cropped Image:")
         self.download_button.config(state=tk.DISABLED)
-        self.canvas.delete("all")
+        self.hide_canvas_item(self.cropped_pic_id)
+        self.hide_canvas_item(self.rectangle_pic_id)
+
+    # Show a picture item at the position, creating the item only the first time
+    def show_canvas_picture(self, item_id, x, y, photo):
+        with self.trace.span("canvas draw"):
+            if item_id is None:
+                self.canvas_items_created += 1
+                return self.canvas.create_image(x, y, anchor=tk.NW, image=photo)
+            self.canvas.coords(item_id, x, y)
+            self.canvas.itemconfig(item_id, image=photo, state=tk.NORMAL)
+            return item_id
+
+    # Hide a canvas item so it can be shown again later without recreating it
+    def hide_canvas_item(self, item_id):
+        if item_id is not None:
+            self.canvas.itemconfig(item_id, state=tk.HIDDEN)
+
+    # Log and reset the number of canvas items created by an interaction
+    def report_canvas_items(self, interaction):
+        self.canvas_items_report = f"{interaction}: {self.canvas_items_created} canvas items created"
+        log.debug(self.canvas_items_report)
+        self.canvas_items_created = 0
 
     # Display background, resize the image and main image on the screen
     def update_displayed_picture(self, event=None):
         """Resize and display the original image and background on canvas."""
-        self.canvas.delete("all")
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        self.canvas_size = (cw, ch)
 
         # Display background picture
         if self.background_orginal:
-            cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
-            bg_resized = self.background_orginal.resize((cw, ch), Image.Resampling.LANCZOS)
-            self.canvas.bg_img = ImageTk.PhotoImage(bg_resized)
-            self.canvas.create_image(0, 0, anchor=tk.NW, image=self.canvas.bg_img)
+            _, self.canvas.bg_img = self.cached_photo(
+                ("background",), (cw, ch),
+                lambda: self.background_orginal.resize((cw, ch), Image.Resampling.LANCZOS)
+            )
+            self.background_pic_id = self.show_canvas_picture(self.background_pic_id, 0, 0, self.canvas.bg_img)
+            self.canvas.tag_lower(self.background_pic_id)
 
         # Display the uploaded original picture
-        if self.original_picture:
-            max_w = self.canvas.winfo_width() // 2 - 20
-            max_h = self.canvas.winfo_height() - 40
+        if self.original_size:
+            max_w = cw // 2 - 20
+            max_h = ch - 40
+
+            # Fit the original size inside the left half without enlarging it
+            fit = min(max_w / self.original_size[0], max_h / self.original_size[1], 1)
+            width = max(1, round(self.original_size[0] * fit))
+            height = max(1, round(self.original_size[1] * fit))
 
-            self.resized_picture = self.original_picture.copy()
-            self.resized_picture.thumbnail((max_w, max_h), Image.Resampling.LANCZOS)
-            self.scale_ratio = self.original_picture.width / self.resized_picture.width
+            self.resized_picture, img_tk = self.cached_photo(
+                ("picture", self.picture_path), (width, height),
+                lambda: self.timed("thumbnail", pyramid_preview, self.picture_pyramid, width, height)
+            )
+            self.scale_ratio = self.original_size[0] / self.resized_picture.width
 
-            img_tk = ImageTk.PhotoImage(self.resized_picture)
             self.canvas.image = img_tk 
-            self.canvas_pic_id = self.canvas.create_image(10, 10, anchor=tk.NW, image=img_tk)
+            self.canvas_pic_id = self.show_canvas_picture(self.canvas_pic_id, 10, 10, img_tk)
 
             # Saves displayed image position and size for cropping
             self.display_pic_x, self.display_pic_y = 10, 10
             self.display_pic_width, self.display_pic_height = self.resized_picture.size
 
+        # Fit the cropped picture to the new right half
+        if self.picture_edits:
+            self.display_cropped_picture()
+        self.report_canvas_items("redraw")
+
     # Displays the crop rectangle when mouse is pressed on the picture
     def start_crop(self, event):
+        if not self.original_size:
+            return
+        self.cropping = True
         self.crop_start_x = event.x
         self.crop_start_y = event.y 
-        # Removes previous cropped rectangle if exists
-        if self.rectangle_pic_id:
-            self.canvas.delete(self.rectangle_pic_id)
-        # Creates new cropped rectangle starting at the press position
-        self.rectangle_pic_id = self.canvas.create_rectangle(
-            self.crop_start_x, self.crop_start_y, self.crop_start_x, self.crop_start_y,
-            outline='#FF4C4C', width=2, dash=(4, 2)
-        )
+        # Creates the cropped rectangle once, then moves it to the press position
+        if self.rectangle_pic_id is None:
+            self.canvas_items_created += 1
+            self.rectangle_pic_id = self.canvas.create_rectangle(
+                self.crop_start_x, self.crop_start_y, self.crop_start_x, self.crop_start_y,
+                outline='#FF4C4C', width=2, dash=(4, 2)
+            )
+        else:
+            self.canvas.coords(self.rectangle_pic_id, self.crop_start_x, self.crop_start_y, self.crop_start_x, self.crop_start_y)
+            self.canvas.itemconfig(self.rectangle_pic_id, state=tk.NORMAL)
+            self.canvas.tag_raise(self.rectangle_pic_id)
 
     # Updates cropped size dynamically as mouse dragged
     def update_crop(self, event):
         """Update crop rectangle during mouse drag, constrained inside image boundaries."""
-        if self.rectangle_pic_id:
+        if self.cropping:
             x = min(max(event.x, self.display_pic_x), self.display_pic_x + self.display_pic_width)
             y = min(max(event.y, self.display_pic_y), self.display_pic_y + self.display_pic_height)
             self.canvas.coords(self.rectangle_pic_id, self.crop_start_x, self.crop_start_y, x, y)
 
     # Finalize cropping on mouse release, crop original picture after valid selection
     def end_crop(self, event):
-        if not self.rectangle_pic_id:
+        if not self.cropping:
             return
+        self.cropping = False
          # Gives coordinates of displayed picture area
         x = min(max(event.x, self.display_pic_x), self.display_pic_x + self.display_pic_width)
         y = min(max(event.y, self.display_pic_y), self.display_pic_y + self.display_pic_height)
 
         # Update rectangle coordinates on canvas
         self.canvas.coords(self.rectangle_pic_id, self.crop_start_x, self.crop_start_y, x, y)
-        x0, y0, x1, y1 = self.canvas.coords(self.rectangle_pic_id)
-
-        # Calculates cropped area relative to displayed picture
-        cropped_x0 = max(x0 - self.display_pic_x, 0)
-        cropped_y0 = max(y0 - self.display_pic_y, 0)
-        cropped_x1 = max(x1 - self.display_pic_x, 0)
-        cropped_y1 = max(y1 - self.display_pic_y, 0)
-
-        # Using scale ratio, scales cropped coordinate back to original picture coordinates 
-        x0_org = max(0, min(int(cropped_x0 * self.scale_ratio), self.original_picture.width))
-        y0_org = max(0, min(int(cropped_y0 * self.scale_ratio), self.original_picture.height))
-        x1_org = max(0, min(int(cropped_x1 * self.scale_ratio), self.original_picture.width))
-        y1_org = max(0, min(int(cropped_y1 * self.scale_ratio), self.original_picture.height))
+        box = display_box_to_original(
+            self.canvas.coords(self.rectangle_pic_id), (self.display_pic_x, self.display_pic_y),
+            self.scale_ratio, self.original_size
+        )
 
         # Crops the picture only if dragged area is valid
-        if x1_org > x0_org and y1_org > y0_org:
-            self.cropped_pil_pic = self.original_picture.crop((x0_org, y0_org, x1_org, y1_org))
+        if box:
+            self.picture_edits = PictureEdits(self.original_size, box)
             self.resize_slider.set(100)
+            self.cancel_slider_render() # set() ran move_slider, the final render below replaces its preview
             self.resize_label_value.set("Resize Cropped Image:")
-            self.display_cropped_picture(self.cropped_pil_pic)
+            self.record_edit()
+            self.display_cropped_picture()
             self.download_button.config(state=tk.NORMAL)
 
-        # Removes cropped rectangle
-        self.canvas.delete(self.rectangle_pic_id)
-        self.rectangle_pic_id = None
+        # Hides cropped rectangle until the next crop
+        self.hide_canvas_item(self.rectangle_pic_id)
+        self.report_canvas_items("crop")
 
     # Displays the cropped pciture resized from slider
-    def display_cropped_picture(self, cropped_img):
-        if self.cropped_pic_id:
-            self.canvas.delete(self.cropped_pic_id)
-
+    def display_cropped_picture(self, resample=Image.Resampling.LANCZOS):
+        if not self.picture_edits:
+            return
         padding = 10
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
@@ -268,47 +642,92 @@ class CropYourImage:
         max_width = (canvas_width // 2) - 2 * padding
         max_height = canvas_height - 2 * padding
 
-        scale_percent = max(self.resize_slider.get(), 0)  # Range 0-100
+        self.picture_edits.scale_percent = max(self.resize_slider.get(), 0)  # Range 0-100
+
+        # Fits resized picture to maximum available size keeping its shape
+        w, h = self.picture_edits.output_size()
+        fit = min(max_width / w, max_height / h, 1)
+        size = (max(1, int(w * fit)), max(1, int(h * fit)))
+
+        # Fit picture on right half
+        x = canvas_width // 2 + padding
+        y = padding
+
+        # Steps visited before are shown from the history when their picture is still kept
+        edits = copy.copy(self.picture_edits)
+        remembered = self.history.picture(edits, size, resample)
+        if remembered:
+            self.drop_job("cropped preview")
+            self.show_cropped_picture(remembered, x, y)
+            return
 
-        # Calculate resized size from slider scale
-        w = max(1, int(cropped_img.width * scale_percent / 100))
-        h = max(1, int(cropped_img.height * scale_percent / 100))
+        # Render on the worker from a copy of the edits, an older render still waiting is replaced by this one
+        source = preview_source(self.picture_pyramid, edits, size)
+        path = self.picture_path
+        self.run_job(
+            lambda: self.timed("crop + resize", edits.render, source, size, resample) if source
+            else self.timed("crop + resize (full resolution)", edits.render_file, path, size, resample),
+            lambda resized_crop: self.show_rendered_picture(edits, size, resample, resized_crop, x, y),
+            target="cropped preview"
+        )
 
-        # Fits cropped picture to maximum available size
-        w = min(w, max_width)
-        h = min(h, max_height)
+    # Keep final quality renders for undo and redo, slider previews are thrown away
+    def show_rendered_picture(self, edits, size, resample, resized_crop, x, y):
+        if resample == Image.Resampling.LANCZOS:
+            self.history.remember_picture(edits, size, resample, resized_crop)
+        self.show_cropped_picture(resized_crop, x, y)
 
-        resized_crop = cropped_img.resize((w, h), Image.Resampling.LANCZOS)
+    # Show the resized cropped picture made by the worker thread
+    def show_cropped_picture(self, resized_crop, x, y):
+        if not self.picture_edits: # Crop was cleared while resizing
+            return
         self.current_resized_cropped = resized_crop
 
-        img_tk = ImageTk.PhotoImage(resized_crop)
+        with self.trace.span("PhotoImage"):
+            img_tk = ImageTk.PhotoImage(resized_crop)
 
         # Prevents garbage collection of pictures
         self.reference_picture.clear()
         self.reference_picture.append(img_tk)
         
-        # Fit picture on right half
-        x = canvas_width // 2 + padding
-        y = padding
-        self.cropped_pic_id = self.canvas.create_image(x, y, anchor=tk.NW, image=img_tk)
+        self.cropped_pic_id = self.show_canvas_picture(self.cropped_pic_id, x, y, img_tk)
 
     # Move slider to resize the cropped picture
     def move_slider(self, val):
         percent = int(float(val))
         self.slider_value.config(text=f"{percent}%")
-        if self.cropped_pil_pic:
-            # Delay to avoid flooding updates while dragging
-            self.root.after(50, lambda: self.display_cropped_picture(self.cropped_pil_pic))
-
-    # Shows warning when slider is released before cropping picture
-    def slider_warning(self, event):
-        if not self.cropped_pil_pic:
-            messagebox.showwarning("Resize Image", "No cropped image to resize!")
+        if self.picture_edits:
+            # Keep at most one pending render while dragging, it picks up the latest slider position
+            if not self.slider_after_id:
+                self.slider_after_id = self.root.after(SLIDER_RENDER_MS, self.render_slider_preview)
+
+    # Quick low quality preview while the slider is still moving
+    def render_slider_preview(self):
+        self.slider_after_id = None
+        self.display_cropped_picture(Image.Resampling.BILINEAR)
+
+    # Cancel the preview render still waiting for the slider
+    def cancel_slider_render(self):
+        if self.slider_after_id:
+            self.root.after_cancel(self.slider_after_id)
+            self.slider_after_id = None
+
+    # Shows warning when slider is released with the mouse before cropping picture
+    # Otherwise renders the final high quality picture
+    def slider_released(self, event):
+        if not self.picture_edits:
+            if event.type == tk.EventType.ButtonRelease: # Arrow keys on the focused slider only move it back
+                messagebox.showwarning("Resize Image", "No cropped image to resize!")
             self.resize_slider.set(100)
+            return
+        self.cancel_slider_render()
+        self.picture_edits.scale_percent = max(self.resize_slider.get(), 0)
+        self.record_edit()
+        self.display_cropped_picture()
 
-     # Saves the recent resized cropped picture
+     # Saves the cropped picture rendered once at full resolution
     def download_cropped_picture(self):
-        if not self.current_resized_cropped:
+        if not self.picture_edits:
             messagebox.showwarning("Save Image", "No image to save!")
             return
         # Opens file dialog to choose location and file type to save cropped picture
@@ -317,48 +736,316 @@ class CropYourImage:
             filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg;*.jpeg")]
         )
         if path:
-            try:
-                self.current_resized_cropped.save(path)
-                messagebox.showinfo("Save Image", f"Image saved to:\n{path}")
-            except Exception as e:
-                messagebox.showerror("Save Image", f"Failed to save:\n{str(e)}")
+            edits, source = copy.copy(self.picture_edits), self.picture_path
+            self.run_job(
+                lambda: self.timed("export", export_picture, source, edits, path),
+                lambda result: messagebox.showinfo(
+                    "Save Image", f"Image saved to:\n{path}\n{result[0]}, {result[2] / 1024:.0f} KB in {result[1]:.2f} s"
+                ),
+                failed=lambda e: messagebox.showerror("Save Image", f"Failed to save:\n{str(e)}")
+            )
 
     #  Clear the cropped picture and reset the frame displaying only original picture
     def clear_cropped_area(self):
-        if not self.cropped_pil_pic:
+        if not self.picture_edits:
             messagebox.showwarning("Clear Crop", "No image to clear!")
             return
         # Reset cropping related state variables
         self.crop_start_x = self.crop_start_y = 0
-        self.rectangle_pic_id = None
-        self.cropped_pil_pic = None
+        self.picture_edits = None
         self.current_resized_cropped = None
-        # Clear all canvas cropped image, rectangle
-        self.canvas.delete("all")
-        # Redraw the original picture and background
-        self.update_displayed_picture()
+        self.record_edit()
+        # Hide cropped image and rectangle, the original picture and background stay as they are
+        self.hide_canvas_item(self.cropped_pic_id)
+        self.hide_canvas_item(self.rectangle_pic_id)
+        self.download_button.config(state=tk.DISABLED)
+        self.report_canvas_items("clear crop")
     
     # Flip the cropped image and creates mirror effect
     def flip_picture(self):
-        if self.cropped_pil_pic:
-            self.cropped_pil_pic = self.cropped_pil_pic.transpose(Image.FLIP_LEFT_RIGHT)
-            self.display_cropped_picture(self.cropped_pil_pic)
+        if self.picture_edits:
+            self.picture_edits.flip()
+            self.record_edit()
+            self.display_cropped_picture()
 
     # Rotates the cropped picture 90 degrees counter-clockwise
     def rotate_picture_left(self):
-        if self.cropped_pil_pic:
-            self.cropped_pil_pic = self.cropped_pil_pic.rotate(90, expand=True)
-            self.display_cropped_picture(self.cropped_pil_pic)
+        if self.picture_edits:
+            self.picture_edits.rotate(1)
+            self.record_edit()
+            self.display_cropped_picture()
 
     
     # Rotate the cropped image 90 degrees clockwise
     def rotate_picture_right(self):
-        if self.cropped_pil_pic:
-            self.cropped_pil_pic = self.cropped_pil_pic.rotate(-90, expand=True)
-            self.display_cropped_picture(self.cropped_pil_pic)
+        if self.picture_edits:
+            self.picture_edits.rotate(-1)
+            self.record_edit()
+            self.display_cropped_picture()
+
+    # Add the current edits to the undo history
+    def record_edit(self):
+        self.history.record(self.picture_edits)
+        self.update_history_buttons()
+        log.debug("edit history: %d steps, %.1f MB", len(self.history.steps), self.history.memory() / 1e6)
+
+    def undo_edit(self, event=None):
+        if self.history.can_undo():
+            self.show_history_step(self.history.undo())
+
+    def redo_edit(self, event=None):
+        if self.history.can_redo():
+            self.show_history_step(self.history.redo())
+
+    # Make edits from the history current, rendering them again only when their picture is not kept
+    def show_history_step(self, edits):
+        self.picture_edits = edits
+        self.resize_slider.set(edits.scale_percent if edits else 100)
+        self.cancel_slider_render() # Setting the slider must not start a low quality preview
+        self.update_history_buttons()
+        if edits:
+            self.download_button.config(state=tk.NORMAL)
+            self.display_cropped_picture()
+        else:
+            self.drop_job("cropped preview")
+            self.current_resized_cropped = None
+            self.hide_canvas_item(self.cropped_pic_id)
+            self.download_button.config(state=tk.DISABLED)
+
+    def update_history_buttons(self):
+        self.undo_button.config(state=tk.NORMAL if self.history.can_undo() else tk.DISABLED)
+        self.redo_button.config(state=tk.NORMAL if self.history.can_redo() else tk.DISABLED)
+
+# Decode the background picture, JPEGs are decoded at a reduced size when the screen is smaller
+def load_background(screen_size):
+    picture = Image.open(BACKGROUND_FILE)
+    picture.draft("RGB", screen_size)
+    picture.load()
+    return picture
+
+# Runs every job right away on the calling thread, how the app did its picture work before the worker threads
+class InlineExecutor:
+    def submit(self, function):
+        future = Future()
+        try:
+            future.set_result(function())
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+# Runs the steps of a scripted session on the Tk main loop of a real app window. A step starts once
+# the jobs, slider previews and redraws of the one before are done, or after the milliseconds it returns.
+# A timer set every BENCHMARK_TICK_MS records how late the main loop ran it, that is how long the window froze
+class ScriptedSession:
+    def __init__(self, app, steps):
+        self.app = app
+        self.steps = list(steps)
+        self.delays = [] # Seconds each tick ran late
+        self.running = False
+
+    # Returns the delays of the ticks
+    def run(self):
+        self.running = True
+        self.app.root.after(BENCHMARK_STEP_MS, self.next_step)
+        self.app.root.after(BENCHMARK_TICK_MS, self.tick, time.perf_counter() + BENCHMARK_TICK_MS / 1000)
+        self.app.root.mainloop()
+        return self.delays
+
+    def tick(self, due):
+        now = time.perf_counter()
+        self.delays.append(max(0.0, now - due))
+        if self.running:
+            self.app.root.after(BENCHMARK_TICK_MS, self.tick, now + BENCHMARK_TICK_MS / 1000)
+
+    def busy(self):
+        app = self.app
+        return app.jobs or app.slider_after_id or app.resize_after_id
+
+    def next_step(self):
+        if self.busy():
+            self.app.root.after(WORKER_POLL_MS, self.next_step)
+        elif self.steps:
+            wait_ms = self.steps.pop(0)()
+            self.app.root.after(wait_ms or BENCHMARK_STEP_MS, self.next_step)
+        else:
+            self.running = False
+            self.app.root.quit()
+
+# Build the app for a benchmark in the window, with its preview cache and recent pictures in cache_dir
+def benchmark_app(root, cache_dir, inline=False):
+    for widget in root.winfo_children():
+        widget.destroy()
+    app = CropYourImage(root, cache_dir)
+    if inline:
+        app.worker.shutdown()
+        app.thumbnail_worker.shutdown()
+        app.worker = app.thumbnail_worker = InlineExecutor()
+    root.update()
+    return app
+
+# Stop the workers of a benchmark app once its session is over
+def close_benchmark_app(app):
+    app.worker.shutdown(wait=True, cancel_futures=True)
+    app.thumbnail_worker.shutdown(wait=True, cancel_futures=True)
+
+# Press the mouse at one corner of the shown picture and release it at the other, cropping most of it
+def drag_crop(app):
+    x, y, width, height = app.display_pic_x, app.display_pic_y, app.display_pic_width, app.display_pic_height
+    app.start_crop(SimpleNamespace(x=x + width // 20, y=y + height // 20))
+    app.end_crop(SimpleNamespace(x=x + width * 19 // 20, y=y + height * 19 // 20))
+
+# Open the picture, crop it, rotate left and right, flip, drag the slider down to half size, undo and redo
+def editing_session(app, path):
+    return [
+        lambda: app.open_picture_path(path),
+        lambda: drag_crop(app),
+        app.rotate_picture_left,
+        app.rotate_picture_right,
+        app.flip_picture,
+        *(lambda percent=percent: app.resize_slider.set(percent) for percent in range(95, 45, -5)),
+        lambda: app.slider_released(SimpleNamespace(type=tk.EventType.ButtonRelease)),
+        app.undo_edit,
+        app.redo_edit,
+    ]
+
+# Longest freeze of the window during an editing session of a 50 MP JPEG, with the picture jobs run on the
+# Tk thread as before the worker threads, then on the worker threads. Includes the work the app still does
+# on the Tk thread, the preview cache, display resizes and PhotoImages
+def responsiveness_benchmark(root):
+    path = benchmark_path(".jpg")
+    try:
+        write_test_jpeg(path, BENCHMARK_JPEG_SIZE)
+        print(f"{BENCHMARK_JPEG_SIZE[0]}x{BENCHMARK_JPEG_SIZE[1]} JPEG: open, crop, rotate left and right, flip, "
+              f"slider to 50%, undo, redo")
+        for name, inline in (("jobs on the Tk thread", True), ("jobs on the worker threads", False)):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                app = benchmark_app(root, cache_dir, inline)
+                started = time.perf_counter()
+                delays = ScriptedSession(app, editing_session(app, path)).run()
+                seconds = time.perf_counter() - started
+                close_benchmark_app(app)
+            print(f"{name}: longest freeze {max(delays) * 1000:.0f} ms, {sum(delay > 0.05 for delay in delays)} "
+                  f"of {len(delays)} ticks over 50 ms late, session {seconds:.2f} s")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Open a picture, then drag the window corner through RESIZE_STORM_EVENTS sizes, go back to the first size
+# and then to the last one again. Redraws and CPU time of that, with every Configure event redrawing without
+# the PhotoImage cache as before, then debounced with the cache
+def resize_benchmark(root):
+    path = benchmark_path(".jpg")
+    sizes = [f"{1000 + 3 * i}x{650 + 2 * i}" for i in range(RESIZE_STORM_EVENTS)]
+    try:
+        write_test_jpeg(path, BENCHMARK_JPEG_SIZE)
+        for name, debounced in (("redraw on every event", False), ("debounced with the cache", True)):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                root.geometry(sizes[0])
+                app = benchmark_app(root, cache_dir)
+                redraws = []
+                redraw = app.update_displayed_picture
+                def counted_redraw(event=None):
+                    redraws.append(event)
+                    redraw()
+                app.update_displayed_picture = counted_redraw
+                if not debounced:
+                    root.bind("<Configure>", app.update_displayed_picture)
+                    app.cached_photo = lambda source, size, make_picture: uncached_photo(make_picture)
+                cpu = []
+
+                def storm():
+                    redraws.clear()
+                    cpu.append(time.process_time())
+                    for i, size in enumerate(sizes):
+                        root.after(i * RESIZE_STORM_MS, root.geometry, size)
+                    return len(sizes) * RESIZE_STORM_MS + BENCHMARK_STEP_MS
+
+                def finish():
+                    root.update()
+                    cpu.append(time.process_time())
+
+                steps = [lambda: app.open_picture_path(path), storm,
+                         lambda: root.geometry(sizes[0]), lambda: root.geometry(sizes[-1]), finish]
+                ScriptedSession(app, steps).run()
+                close_benchmark_app(app)
+            background = "" if app.background_orginal else ", no background picture"
+            print(f"{name}: {len(redraws)} redraws, {cpu[1] - cpu[0]:.2f} s CPU{background}")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Picture resized and turned into a PhotoImage on every redraw, how redraws worked before the cache
+def uncached_photo(make_picture):
+    picture = make_picture()
+    return picture, ImageTk.PhotoImage(picture)
+
+# Time until an opened 50 MP JPEG is on screen and until its full pyramid is loaded, the first time and
+# then in a new session, where the preview comes from the cache
+def open_benchmark(root):
+    path = benchmark_path(".jpg")
+    try:
+        write_test_jpeg(path, BENCHMARK_JPEG_SIZE)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for name in ("first open", "preview cached"):
+                app = benchmark_app(root, cache_dir)
+                times = {}
+                show_picture, show_full_picture = app.show_uploaded_picture, app.show_full_picture
+
+                def shown(*args):
+                    show_picture(*args)
+                    root.update_idletasks()
+                    times.setdefault("shown", time.perf_counter())
+
+                def loaded(*args):
+                    show_full_picture(*args)
+                    root.update_idletasks()
+                    times["loaded"] = time.perf_counter()
+
+                def open_picture():
+                    times["started"] = time.perf_counter()
+                    app.open_picture_path(path)
+
+                app.show_uploaded_picture, app.show_full_picture = shown, loaded
+                ScriptedSession(app, [open_picture]).run()
+                close_benchmark_app(app)
+                print(f"{name}: picture shown after {(times['shown'] - times['started']) * 1000:.1f} ms, "
+                      f"full picture after {(times['loaded'] - times['started']) * 1000:.0f} ms")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Command line flag -> benchmark run in the app window instead of the app
+BENCHMARKS = {
+    "--responsiveness-benchmark": responsiveness_benchmark,
+    "--resize-benchmark": resize_benchmark,
+    "--open-benchmark": open_benchmark,
+}
 
 # Initialize the application window and run Crop Your Image app
 if __name__ == "__main__":
-    app_root = ttk.Window(themename="minty")
+    if os.environ.get(LOG_ENV):
+        logging.basicConfig(level=os.environ[LOG_ENV].upper())
+    # Theme and bindings ttk.Window would set up, applied to the window already on screen
+    ttk.Style(theme="minty")
+    apply_class_bindings(app_root)
+    apply_all_bindings(app_root)
+    for widget in app_root.winfo_children():
+        widget.destroy()
+    themed = time.perf_counter()
+    benchmark = next((BENCHMARKS[arg] for arg in sys.argv[1:] if arg in BENCHMARKS), None)
+    if benchmark:
+        benchmark(app_root)
+        app_root.destroy()
+        sys.exit()
     CropYourImage(app_root)
-    app_root.mainloop()
\ No newline at end of file
+    if "--startup-benchmark" in sys.argv[1:]:
+        # Milliseconds from the start of the script until each startup stage was done
+        app_root.update()
+        print(f"first paint {(FIRST_PAINT - STARTED) * 1000:.0f} ms, imports {(IMPORTED - STARTED) * 1000:.0f} ms, "
+              f"theme {(themed - STARTED) * 1000:.0f} ms, app window painted {(time.perf_counter() - STARTED) * 1000:.0f} ms")
+        app_root.destroy()
+    else:
+        app_root.mainloop()